@@ -2,10 +2,80 @@
 
 import os
 
+import numpy as np
 import pandas as pd
 import skbio
 from scipy.stats import false_discovery_control
-from src.GO.enrich import hypergeom_test
+from src.brownian.linkage import get_tip_ranges
+from src.GO.enrich import get_incidence, get_label_matrix, get_range_term_counts, hypergeom_sf
+
+
+def get_tables(ks, Ns, M, ns, terms, tip_keys, starts, stops, cluster_ids, id_label, min_k,
+               write_regions=True, batch_size=100000):
+    """Return tables of p-values and clusters for nodes with ids in the column id_label.
+
+    Parameters
+    ----------
+    ks: ndarray
+        Number of regions of each node with each term with shape (number of terms, number of nodes)
+    Ns: ndarray
+        Number of annotated regions of each node
+    M: int
+        Number of annotated regions
+    ns: ndarray
+        Number of annotated regions with each term
+    terms: MultiIndex
+        Keys of terms in order of rows of ks
+    tip_keys: DataFrame
+        Keys of regions of tips in postorder
+    starts, stops: ndarray
+        Range of tips of each node
+    cluster_ids: ndarray
+        Ids of nodes
+    id_label: str
+    min_k: int
+        Minimum number of annotated regions of a node with a term to test it
+    write_regions: bool
+        If True, include column of regions of each node in clusters table
+    batch_size: int
+        Maximum number of tests passed to hypergeom_sf in a single call
+
+    Returns
+    -------
+    pvalues: DataFrame
+    clusters: DataFrame
+    """
+    # Calculate p-values for all nodes in batches of tests to bound memory
+    term_idx, node_idx = np.nonzero(ks >= min_k)
+    pvalues = np.empty(len(term_idx))
+    for i in range(0, len(term_idx), batch_size):
+        batch_terms, batch_nodes = term_idx[i:i + batch_size], node_idx[i:i + batch_size]
+        pvalues[i:i + batch_size] = hypergeom_sf(ks[batch_terms, batch_nodes], M, ns[batch_terms], Ns[batch_nodes])
+    pvalues = pd.DataFrame({id_label: cluster_ids[node_idx], 'pvalue': pvalues,
+                            'k': ks[term_idx, node_idx], 'n': ns[term_idx]})
+    pvalues = pd.concat([pvalues, terms[term_idx].to_frame(index=False)], axis=1)
+
+    cluster_rows = []
+    for j, (start, stop, cluster_id) in enumerate(zip(starts, stops, cluster_ids)):
+        enrichment_keys = tip_keys.iloc[start:stop]
+        row = {id_label: cluster_id,
+               'num_regions': len(enrichment_keys), 'num_OGids': enrichment_keys['OGid'].nunique(),
+               'num_tests': (ks[:, j] > 0).sum()}
+        if write_regions:
+            row['regions'] = ','.join([f'{row.OGid}-{row.start}-{row.stop}' for row in enrichment_keys.itertuples()])
+        cluster_rows.append(row)
+    pvalues = pvalues.sort_values(by=[id_label, 'aspect', 'pvalue'], ignore_index=True)
+    clusters = pd.DataFrame(cluster_rows)
+
+    dfs = []
+    for _, group in pvalues.groupby(id_label):
+        group['pvalue_adj'] = false_discovery_control(group['pvalue'])
+        dfs.append(group)
+    columns = [id_label, 'pvalue', 'pvalue_adj', 'k', 'n', 'aspect', 'GOid', 'name']
+    pvalues = pd.concat(dfs)[columns] if dfs else pd.DataFrame(columns=columns)
+
+    return pvalues, clusters
+
 
 pdidx = pd.IndexSlice
 min_length = 30
@@ -15,6 +85,7 @@ min_aa_rate = 1
 min_indel_rate = 0.1
 
 min_k = 2  # Minimum number of positive annotations in enrichment set
+min_size = 20  # Minimum number of regions in internal nodes enriched in sweep
 
 clusters = [('15126', '1'),
             ('15136', '2'),
@@ -93,43 +164,41 @@ with open('../../brownian/model_stats/out/regions_30/hierarchy/heatmap_all_corre
         node_id = int(fields['node_id'])
         id2ids[node_id] = (OGid, start, stop, disorder)
 
-pvalue_rows = []
-cluster_rows = []
-for root_id, cluster_id in clusters:
-    root_node = tree.find(root_id)
-    enrichment_keys = pd.DataFrame([id2ids[int(tip.name)] for tip in root_node.tips()],
-                                   columns=['OGid', 'start', 'stop', 'disorder'])
-    enrichment_gaf = reference_gaf.merge(enrichment_keys, how='inner', on=['OGid', 'start', 'stop', 'disorder'])
-
-    terms = list(enrichment_gaf[['aspect', 'GOid', 'name']].drop_duplicates().itertuples(index=False, name=None))
-    M = reference_gaf.groupby(['OGid', 'start', 'stop', 'disorder']).ngroups
-    N = enrichment_gaf.groupby(['OGid', 'start', 'stop', 'disorder']).ngroups
-
-    for aspect, GOid, name in terms:
-        k = enrichment_gaf[enrichment_gaf['GOid'] == GOid].groupby(['OGid', 'start', 'stop', 'disorder']).ngroups
-        n = reference_gaf[reference_gaf['GOid'] == GOid].groupby(['OGid', 'start', 'stop', 'disorder']).ngroups
-        if k < min_k:
-            continue
-        pvalue = hypergeom_test(k, M, n, N)
-        pvalue_rows.append({'cluster_id': int(cluster_id),
-                            'pvalue': pvalue, 'k': k, 'n': n,
-                            'aspect': aspect, 'GOid': GOid, 'name': name})
-
-    cluster_rows.append({'cluster_id': int(cluster_id),
-                         'num_regions': len(enrichment_keys), 'num_OGids': enrichment_keys['OGid'].nunique(),
-                         'num_tests': len(terms),
-                         'regions': ','.join([f'{row.OGid}-{row.start}-{row.stop}' for row in enrichment_keys.itertuples()])})
-pvalues = pd.DataFrame(pvalue_rows).sort_values(by=['cluster_id', 'aspect', 'pvalue'], ignore_index=True)
-clusters = pd.DataFrame(cluster_rows)
-
-dfs = []
-for _, group in pvalues.groupby('cluster_id'):
-    group['pvalue_adj'] = false_discovery_control(group['pvalue'])
-    dfs.append(group)
-pvalues = pd.concat(dfs)[['cluster_id', 'pvalue', 'pvalue_adj', 'k', 'n', 'aspect', 'GOid', 'name']]
+# Get counts for nodes from the cumulative sums of the labels of tips in postorder
+# The tips descending from each node are a contiguous range in postorder, so the counts of a node are the difference
+# of the cumulative sums at the ends of its range
+tips, nodes, starts, stops = get_tip_ranges(tree)
+tip_keys = pd.DataFrame([id2ids[int(tip.name)] for tip in tips], columns=['OGid', 'start', 'stop', 'disorder'])
+
+objects, terms, incidence = get_incidence(reference_gaf, ['OGid', 'start', 'stop', 'disorder'])
+labels = get_label_matrix(objects, incidence, tip_keys)
+M = incidence.shape[0]
+ns = np.asarray(incidence.sum(axis=0)).ravel()
 
 if not os.path.exists('out/'):
     os.mkdir('out/')
 
+# Selected clusters
+name2idx = {node.name: idx for idx, node in enumerate(nodes)}
+node_idxs = np.array([name2idx[root_id] for root_id, _ in clusters], dtype=int)
+cluster_ids = np.array([int(cluster_id) for _, cluster_id in clusters])
+ks, Ns = get_range_term_counts(labels, starts[node_idxs], stops[node_idxs])
+pvalues, clusters = get_tables(ks, Ns, M, ns, terms, tip_keys, starts[node_idxs], stops[node_idxs],
+                               cluster_ids, 'cluster_id', min_k)
+
 pvalues.to_csv('out/pvalues.tsv', sep='\t', index=False)
 clusters.to_csv('out/clusters.tsv', sep='\t', index=False)
+
+# Sweep of all internal nodes above size threshold
+if not os.path.exists('out/sweep/'):
+    os.mkdir('out/sweep/')
+
+node_idxs = np.array([idx for idx, node in enumerate(nodes)
+                      if not node.is_tip() and stops[idx] - starts[idx] >= min_size], dtype=int)
+node_ids = np.array([int(nodes[idx].name) for idx in node_idxs], dtype=int)
+ks, Ns = get_range_term_counts(labels, starts[node_idxs], stops[node_idxs])
+pvalues, clusters = get_tables(ks, Ns, M, ns, terms, tip_keys, starts[node_idxs], stops[node_idxs],
+                               node_ids, 'node_id', min_k, write_regions=False)
+
+pvalues.to_csv('out/sweep/pvalues.tsv', sep='\t', index=False)
+clusters.to_csv('out/sweep/nodes.tsv', sep='\t', index=False)
@@ -6,20 +6,13 @@ from functools import reduce
 from operator import add
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+import scipy.sparse as sparse
+from src.GO.ontology import load_ontology
 from src.utils import read_fasta
 
 
-def get_ancestors(GO, GOid):
-    ancestors = set()
-    parent_stack = GO[GOid]['parents'].copy()
-    while parent_stack:
-        parent = parent_stack.pop()
-        ancestors.add(parent)
-        parent_stack.extend(GO[parent]['parents'])
-    return ancestors
-
-
 def write_table(counts, title):
     if counts.empty:  # Immediately return on empty table
         return
@@ -43,46 +36,92 @@ def write_table(counts, title):
         file.write(padding + output)
 
 
+def get_stats(gaf):
+    """Return counts of annotations and terms of a GAF table for plotting."""
+    return {'num_annotations': len(gaf),
+            'aspect': gaf['aspect'].value_counts(),
+            'evidence': gaf['evidence'].value_counts(),
+            'num_terms': gaf['GOid'].nunique(),
+            'term_aspect': gaf[['GOid', 'aspect']].drop_duplicates()['aspect'].value_counts()}
+
+
+def get_sparse_stats(records, annotations):
+    """Return counts of annotations and terms of a sparse GAF for plotting.
+
+    The counts are those of get_stats on the long table of the records and
+    terms of the non-zero entries of annotations, except aspects and evidence
+    codes without annotations have counts of zero rather than being absent.
+    """
+    row_counts = pd.Series(np.diff(annotations.indptr), index=records.index)
+    stats = {'num_annotations': annotations.nnz,
+             'aspect': row_counts.groupby(records['aspect']).sum(),
+             'evidence': row_counts.groupby(records['evidence']).sum(),
+             'num_terms': np.count_nonzero(annotations.getnnz(axis=0))}
+
+    codes, aspects = pd.factorize(records['aspect'])
+    selection = sparse.csr_matrix((np.ones(len(codes), dtype=bool), (codes, np.arange(len(codes)))),
+                                  shape=(len(aspects), len(codes)))
+    stats['term_aspect'] = pd.Series((selection @ annotations).getnnz(axis=1), index=aspects)
+    return stats
+
+
+def filter_annotations(records, annotations, group_keys, min_gnids):
+    """Return annotations with terms associated with fewer than min_gnids unique genes removed.
+
+    The number of unique genes associated with each term is counted
+    separately for each group of records with the same values of the keys
+    in group_keys other than GOid.
+    """
+    keys = [key for key in group_keys if key != 'GOid']
+    if keys:
+        group_codes = records.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+    else:
+        group_codes = np.zeros(len(records), dtype=int)
+    num_groups = group_codes.max(initial=-1) + 1
+
+    # Merge records into (group, gnid) pairs so genes are counted once per group
+    pair_codes = records.assign(group=group_codes).groupby(['group', 'gnid'], sort=False).ngroup().to_numpy()
+    num_pairs = pair_codes.max(initial=-1) + 1
+    pair_groups = np.zeros(num_pairs, dtype=int)
+    pair_groups[pair_codes] = group_codes
+
+    pair_selection = sparse.csr_matrix((np.ones(len(records), dtype=bool), (pair_codes, np.arange(len(records)))),
+                                       shape=(num_pairs, len(records)))
+    group_selection = sparse.csr_matrix((np.ones(num_pairs, dtype=np.int64), (pair_groups, np.arange(num_pairs))),
+                                        shape=(num_groups, num_pairs))
+    counts = (group_selection @ (pair_selection @ annotations).astype(np.int64)).tocsr()
+    keep = counts >= min_gnids
+
+    return annotations.multiply(keep[group_codes]).tocsr()
+
+
+def write_sparse_gaf(path, records, annotations, ontology, chunksize=10000):
+    """Write long table of the records and terms of the non-zero entries of annotations.
+
+    The table is written in chunks of records, so only one chunk of the long
+    table is in memory at once.
+    """
+    with open(path, 'w') as file:
+        for start in range(0, len(records), chunksize):
+            stop = min(start + chunksize, len(records))
+            record_idxs, term_idxs = annotations[start:stop].nonzero()
+            gaf = records.iloc[start + record_idxs].assign(GOid=ontology.ids[term_idxs],
+                                                           name=ontology.names[term_idxs])
+            gaf.to_csv(file, sep='\t', index=False, header=(start == 0))
+        if len(records) == 0:
+            pd.DataFrame(columns=[*records.columns, 'GOid', 'name']).to_csv(file, sep='\t', index=False)
+
+
 ppid_regex = r'ppid=([A-Za-z0-9_.]+)'
 gnid_regex = r'gnid=([A-Za-z0-9_.]+)'
 min_length = 30
 min_gnids = 50  # Minimum number of unique genes associated with a term to maintain it in set
 
+if not os.path.exists('out/'):
+    os.mkdir('out/')
+
 # Load ontology
-GO = {}
-with open('../../../data/GO/go-basic.obo') as file:
-    line = file.readline()
-    while line:
-        if line.startswith('[Term]'):
-            parents = []
-            alt_ids = []
-            is_obsolete = False
-            line = file.readline()
-            while line and not line.startswith('['):
-                if line.startswith('id:'):
-                    GOid = line[4:-1]
-                if line.startswith('name:'):
-                    name = line[5:-1]
-                if line.startswith('alt_id:'):
-                    alt_ids.append(line[8:-1])
-                if line.startswith('is_a:'):
-                    parents.append(line.split('!')[0][6:-1])
-                if line.startswith('is_obsolete'):
-                    is_obsolete = line[13:-1] == 'true'
-                line = file.readline()
-            GO[GOid] = {'name': name, 'primary_id': GOid, 'alt_ids': alt_ids, 'parents': parents, 'is_obsolete': is_obsolete}
-            for alt_id in alt_ids:
-                GO[alt_id] = {'name': name, 'primary_id': GOid, 'alt_ids': [], 'parents': [], 'is_obsolete': is_obsolete}
-        else:  # Else suite is necessary so new [Term] line isn't skipped exiting if suite
-            line = file.readline()
-
-# Find term ancestors
-rows = []
-for GOid in GO:
-    rows.append({'GOid': GOid, 'ancestor_id': GOid, 'ancestor_name': GO[GOid]['name']})  # Include self as ancestor so merge keeps original term
-    for ancestor_id in get_ancestors(GO, GOid):
-        rows.append({'GOid': GOid, 'ancestor_id': ancestor_id, 'ancestor_name': GO[ancestor_id]['name']})
-ancestors = pd.DataFrame(rows)
+ontology = load_ontology('../../../data/GO/go-basic.obo', 'out/go-basic.npz')
 
 # Load sequence data
 rows = []
@@ -114,7 +153,8 @@ gaf1 = pd.read_table('../../../data/GO/dmel_r6.45_FB2022_02_gene_association.fb'
                      names=['DB', 'DB_Object_ID', 'DB_Object_Symbol', 'Qualifier', 'GO ID',  # Official column labels
                             'DB:Reference', 'Evidence', 'With (or) From', 'Aspect', 'DB_Object_Name',
                             'DB_Object_Synonym', 'DB_Object_Type', 'taxon', 'Date', 'Assigned_by'])
-gaf1['name'] = gaf1['GO ID'].apply(lambda x: GO[x]['name'])
+term_idxs = ontology.get_idxs(gaf1['GO ID'])
+gaf1['name'] = ontology.names[term_idxs]
 
 # Drop unneeded columns and filter
 mapper = {'DB_Object_ID': 'gnid', 'DB_Object_Symbol': 'symbol', 'Qualifier': 'qualifier', 'GO ID': 'GOid',
@@ -129,12 +169,9 @@ bool2 = gaf2['evidence'].isin(['EXP', 'IDA', 'IPI', 'IMP', 'IGI', 'IEP',  # Remo
                                'HTP', 'HDA', 'HMP', 'HGI', 'HEP',
                                'TAS', 'IC'])
 bool3 = gaf2['taxon'] == 'taxon:7227'  # Keep only dmel annotations
-bool4 = ~gaf2['GOid'].apply(lambda x: GO[x]['is_obsolete'])  # Remove obsolete annotations
+bool4 = ~ontology.is_obsolete[term_idxs]  # Remove obsolete annotations
 gaf3 = gaf2[bool1 & bool2 & bool3 & bool4].drop(['qualifier', 'taxon'], axis=1)
 
-if not os.path.exists('out/'):
-    os.mkdir('out/')
-
 # Identify IDs of obsolete and renamed annotations
 counts = gaf2.loc[~bool4, ['GOid', 'name']].value_counts()
 write_table(counts, 'TOP 10 OBSOLETE ANNOTATIONS (ORIGINAL)')
@@ -144,7 +181,7 @@ write_table(counts, 'TOP 10 OBSOLETE ANNOTATIONS (FILTERED)')
 
 # Update IDs
 gaf4 = gaf3.copy()
-gaf4['GOid'] = gaf4['GOid'].apply(lambda x: GO[x]['primary_id'])
+gaf4['GOid'] = ontology.ids[ontology.primary_idxs[ontology.get_idxs(gaf4['GOid'])]]
 
 counts = gaf3.loc[gaf3['GOid'] != gaf4['GOid'], ['GOid', 'name']].value_counts()
 write_table(counts, 'TOP 10 RENAMED ANNOTATIONS')
@@ -160,18 +197,26 @@ for df, group_keys, prefix in joins:
     gaf5 = df.merge(gaf4, how='inner', on='gnid')
 
     # Propagate ancestors to table and drop poorly represented annotations
+    # Annotations are stored as a sparse matrix of records (all columns except the term) by terms, so propagation is a
+    # product with the closure (which includes each term as its own ancestor so the original term is kept) and the
+    # min_gnid filter is a count over genes. The long tables are only created when written to file.
     # The min_gnid filter is applied to GO terms grouped by disorder subset, so the subset models fulfill the requirement
-    gaf6 = gaf5.merge(ancestors, how='inner', on='GOid').drop(['GOid', 'name'], axis=1)
-    gaf6 = gaf6.rename(columns={'ancestor_id': 'GOid', 'ancestor_name': 'name'}).drop_duplicates()
-    gaf7 = gaf6.groupby(group_keys).filter(lambda x: x['gnid'].nunique() >= min_gnids)
+    records = gaf5.drop(['GOid', 'name'], axis=1)
+    record_codes = records.groupby(list(records.columns), sort=False, dropna=False).ngroup().to_numpy()
+    records = records.drop_duplicates().reset_index(drop=True)  # Same order as groups since sort=False
+    annotations5 = sparse.csr_matrix((np.ones(len(gaf5), dtype=bool), (record_codes, ontology.get_idxs(gaf5['GOid']))),
+                                     shape=(len(records), len(ontology)))
+    annotations6 = (annotations5 @ ontology.closure).tocsr()
+    annotations7 = filter_annotations(records, annotations6, group_keys, min_gnids)
 
     # Make plots
-    gafs = [gaf2, gaf3, gaf4, gaf5, gaf6, gaf7]
+    stats = [get_stats(gaf) for gaf in [gaf2, gaf3, gaf4, gaf5]]
+    stats.extend([get_sparse_stats(records, annotations) for annotations in [annotations6, annotations7]])
     labels = ['original', 'filter', 'update', 'join', 'propagate', 'drop']
 
     # Number of annotations
     fig, ax = plt.subplots()
-    ax.bar(range(len(gafs)), [len(gaf) for gaf in gafs], width=0.5, tick_label=labels)
+    ax.bar(range(len(stats)), [stat['num_annotations'] for stat in stats], width=0.5, tick_label=labels)
     ax.set_xlabel('Cleaning step')
     ax.set_ylabel('Number of annotations')
     fig.savefig(f'{prefix}/bar_numannot-gaf.png')
@@ -179,7 +224,7 @@ for df, group_keys, prefix in joins:
 
     # Number of annotations by aspect
     fig, ax = plt.subplots()
-    counts = [gaf['aspect'].value_counts() for gaf in gafs]
+    counts = [stat['aspect'] for stat in stats]
     bottoms = [0 for count in counts]
     for aspect, aspect_label in [('P', 'Process'), ('F', 'Function'), ('C', 'Component')]:
         ax.bar(range(len(counts)), [count[aspect] for count in counts],
@@ -192,7 +237,7 @@ for df, group_keys, prefix in joins:
     plt.close()
 
     # Number of annotations by evidence code
-    counts = [gaf['evidence'].value_counts() for gaf in gafs]
+    counts = [stat['evidence'] for stat in stats]
     codes = reduce(lambda x, y: x.combine(y, add, fill_value=0), counts).sort_values(ascending=False)
     top_codes = list(codes.index[:9])
     other_codes = list(codes.index[9:])
@@ -217,7 +262,7 @@ for df, group_keys, prefix in joins:
 
     # Number of terms
     fig, ax = plt.subplots()
-    ax.bar(range(len(gafs)), [gaf['GOid'].nunique() for gaf in gafs], width=0.5, tick_label=labels)
+    ax.bar(range(len(stats)), [stat['num_terms'] for stat in stats], width=0.5, tick_label=labels)
     ax.set_xlabel('Cleaning step')
     ax.set_ylabel('Number of unique terms')
     fig.savefig(f'{prefix}/bar_numterms-gaf.png')
@@ -225,7 +270,7 @@ for df, group_keys, prefix in joins:
 
     # Number of terms by aspect
     fig, ax = plt.subplots()
-    counts = [gaf[['GOid', 'aspect']].drop_duplicates()['aspect'].value_counts() for gaf in gafs]
+    counts = [stat['term_aspect'] for stat in stats]
     bottoms = [0 for count in counts]
     for aspect, aspect_label in [('P', 'Process'), ('F', 'Function'), ('C', 'Component')]:
         ax.bar(range(len(counts)), [count[aspect] for count in counts],
@@ -238,5 +283,7 @@ for df, group_keys, prefix in joins:
     plt.close()
 
     # Write GAFs to file
-    for gaf, label in zip(gafs[2:], labels[2:]):
+    for gaf, label in [(gaf4, 'update'), (gaf5, 'join')]:
         gaf.to_csv(f'{prefix}/GAF_{label}.tsv', sep='\t', index=False)
+    for annotations, label in [(annotations6, 'propagate'), (annotations7, 'drop')]:
+        write_sparse_gaf(f'{prefix}/GAF_{label}.tsv', records, annotations, ontology)
@@ -1,11 +1,14 @@
 """Fit rates to GO term logistic regression models."""
 
+import multiprocessing as mp
 import os
 import re
 
+import numpy as np
 import pandas as pd
 from sklearn.decomposition import PCA
-from sklearn.linear_model import LogisticRegression
+from src.GO.enrich import get_incidence, get_label_matrix
+from src.logreg import add_intercept, fit_logreg_batch, get_confusion_metrics, predict_logreg_batch
 from src.utils import read_fasta
 
 
@@ -13,76 +16,107 @@ def zscore(df):
     return (df - df.mean()) / df.std()
 
 
+def init_worker(designs_arg, targets_arg):
+    global designs, targets
+    designs, targets = designs_arg, targets_arg
+
+
+def fit_models(task):
+    label, start, stop = task
+    X, Y_true = designs[label], targets[label][:, start:stop].toarray()
+
+    # Terms without both classes have no model, so they are only fit if valid
+    # Their coefficients and metrics are left as NaN and they are not marked as converged
+    num_positive = Y_true.sum(axis=0)
+    valid = (num_positive > 0) & (num_positive < len(Y_true))
+    Y_valid = Y_true[:, valid]
+
+    # Weight positive samples so both classes have equal total weight
+    w = (len(Y_valid) - num_positive[valid]) / num_positive[valid]
+    weights = np.where(Y_valid, w, 1)
+    betas_valid, converged_valid = fit_logreg_batch(X, Y_valid, weights, max_iter=max_iter)
+
+    Y_pred = predict_logreg_batch(X, betas_valid)
+    metrics_valid = get_confusion_metrics(Y_valid, Y_pred)
+
+    betas = np.full((len(valid), X.shape[1]), np.nan)
+    betas[valid] = betas_valid
+    converged = np.zeros(len(valid), dtype=bool)
+    converged[valid] = converged_valid
+    metrics = {}
+    for key, values in metrics_valid.items():
+        metrics[key] = np.full(len(valid), np.nan)
+        metrics[key][valid] = values
+    return label, start, betas, converged, metrics
+
+
+num_processes = int(os.environ.get('SLURM_CPUS_ON_NODE', 1))
+
 pdidx = pd.IndexSlice
 ppid_regex = r'ppid=([A-Za-z0-9_.]+)'
 gnid_regex = r'gnid=([A-Za-z0-9_.]+)'
 min_length = 30
-
-# Load sequence data
-ppid2gnid = {}
-OGids = sorted([path.removesuffix('.afa') for path in os.listdir('../../../data/alignments/fastas/') if path.endswith('.afa')])
-for OGid in OGids:
-    for header, _ in read_fasta(f'../../../data/alignments/fastas/{OGid}.afa'):
-        ppid = re.search(ppid_regex, header).group(1)
-        gnid = re.search(gnid_regex, header).group(1)
-        ppid2gnid[ppid] = gnid
-
-# Load regions
-rows = []
-with open(f'../../IDRpred/region_filter/out/regions_{min_length}.tsv') as file:
-    field_names = file.readline().rstrip('\n').split('\t')
-    for line in file:
-        fields = {key: value for key, value in zip(field_names, line.rstrip('\n').split('\t'))}
-        OGid, start, stop, disorder = fields['OGid'], int(fields['start']), int(fields['stop']), fields['disorder'] == 'True'
-        ppid = re.search(r'(FBpp[0-9]+)', fields['ppids']).group(1)
-        rows.append({'OGid': OGid, 'start': start, 'stop': stop, 'disorder': disorder, 'gnid': ppid2gnid[ppid]})
-regions = pd.DataFrame(rows)
-
-# Load GOids
-gnid2GOids = {}
-with open('../filter_GAF/out/regions/GAF_drop.tsv') as file:
-    field_names = file.readline().rstrip('\n').split('\t')
-    for line in file:
-        fields = {key: value for key, value in zip(field_names, line.rstrip('\n').split('\t'))}
-        gnid, GOid = fields['gnid'], fields['GOid']
-        try:
-            gnid2GOids[gnid].add(GOid)
-        except KeyError:
-            gnid2GOids[gnid] = {GOid}
-GOids = set.union(*gnid2GOids.values())
-
-contrasts = pd.read_table(f'../../brownian/contrast_compute/out/features/contrasts_{min_length}.tsv', skiprows=[1])
-df1 = regions.merge(contrasts, how='right', on=['OGid', 'start', 'stop'])
-df1 = df1.set_index(['OGid', 'start', 'stop', 'disorder', 'gnid', 'contrast_id'])
-
-rates = (df1 ** 2).groupby(['OGid', 'start', 'stop', 'disorder', 'gnid']).mean()
-rates = zscore(rates)
-disorder = rates.loc[pdidx[:, :, :, True], :]
-order = rates.loc[pdidx[:, :, :, False], :]
-
-if not os.path.exists('out/'):
-    os.mkdir('out/')
-
-rows = []
-for data, label in [(disorder, 'disorder'), (order, 'order'), (rates, 'all')]:
-    pca = PCA(n_components=10)
-    transform = pca.fit_transform(data.to_numpy())[:, :5]
-
-    for GOid in GOids:
-        y_true = [GOid in gnid2GOids.get(gnid, set()) for gnid in data.index.get_level_values('gnid')]
-        w = (len(y_true) - sum(y_true)) / sum(y_true)
-        weights = [w if y else 1 for y in y_true]
-        logreg = LogisticRegression(max_iter=500, penalty='none')
-        logreg.fit(transform, y_true, sample_weight=weights)
-
-        y_pred = logreg.predict(transform)
-        acc = sum([y1 == y2 for y1, y2 in zip(y_true, y_pred)]) / len(y_true)
-        sens = sum([(y1 == y2) and y1 for y1, y2 in zip(y_true, y_pred)]) / sum(y_true)
-        spec = sum([(y1 == y2) and not y1 for y1, y2 in zip(y_true, y_pred)]) / (len(y_true) - sum(y_true))
-        prec = sum([(y1 == y2) and y1 for y1, y2 in zip(y_true, y_pred)]) / sum(y_pred)
-
-        rows.append({'GOid': GOid, 'label': label,
-                     'accuracy': acc, 'sensitivity': sens, 'specificity': spec, 'precision': prec,
-                     **{f'beta{i}': beta for i, beta in enumerate(logreg.coef_[0])}})
-results = pd.DataFrame(rows)
-results.to_csv('out/models.tsv', sep='\t', index=False)
+max_iter = 100
+chunksize = 50  # Number of terms fit together in each task
+
+if __name__ == '__main__':
+    # Load sequence data
+    ppid2gnid = {}
+    OGids = sorted([path.removesuffix('.afa') for path in os.listdir('../../../data/alignments/fastas/') if path.endswith('.afa')])
+    for OGid in OGids:
+        for header, _ in read_fasta(f'../../../data/alignments/fastas/{OGid}.afa'):
+            ppid = re.search(ppid_regex, header).group(1)
+            gnid = re.search(gnid_regex, header).group(1)
+            ppid2gnid[ppid] = gnid
+
+    # Load regions
+    rows = []
+    with open(f'../../IDRpred/region_filter/out/regions_{min_length}.tsv') as file:
+        field_names = file.readline().rstrip('\n').split('\t')
+        for line in file:
+            fields = {key: value for key, value in zip(field_names, line.rstrip('\n').split('\t'))}
+            OGid, start, stop, disorder = fields['OGid'], int(fields['start']), int(fields['stop']), fields['disorder'] == 'True'
+            ppid = re.search(r'(FBpp[0-9]+)', fields['ppids']).group(1)
+            rows.append({'OGid': OGid, 'start': start, 'stop': stop, 'disorder': disorder, 'gnid': ppid2gnid[ppid]})
+    regions = pd.DataFrame(rows)
+
+    # Load GOids
+    gaf = pd.read_table('../filter_GAF/out/regions/GAF_drop.tsv', usecols=['gnid', 'GOid']).sort_values('GOid')
+    gnids, terms, incidence = get_incidence(gaf, ['gnid'], ['GOid'])
+    GOids = list(terms.get_level_values('GOid'))
+
+    contrasts = pd.read_table(f'../../brownian/contrast_compute/out/features/contrasts_{min_length}.tsv', skiprows=[1])
+    df1 = regions.merge(contrasts, how='right', on=['OGid', 'start', 'stop'])
+    df1 = df1.set_index(['OGid', 'start', 'stop', 'disorder', 'gnid', 'contrast_id'])
+
+    rates = (df1 ** 2).groupby(['OGid', 'start', 'stop', 'disorder', 'gnid']).mean()
+    rates = zscore(rates)
+    disorder = rates.loc[pdidx[:, :, :, True], :]
+    order = rates.loc[pdidx[:, :, :, False], :]
+
+    if not os.path.exists('out/'):
+        os.mkdir('out/')
+
+    # Make design and target matrices
+    # Every term model of a data set shares its design matrix, so the terms are fit in batches
+    designs, targets = {}, {}
+    for data, label in [(disorder, 'disorder'), (order, 'order'), (rates, 'all')]:
+        pca = PCA(n_components=10)
+        transform = pca.fit_transform(data.to_numpy())[:, :5]
+        designs[label] = add_intercept(transform)
+        targets[label] = get_label_matrix(gnids, incidence, data.index.to_frame(index=False)[['gnid']])
+
+    tasks = [(label, start, min(start + chunksize, len(GOids)))
+             for label in designs for start in range(0, len(GOids), chunksize)]
+    with mp.Pool(processes=num_processes, initializer=init_worker, initargs=(designs, targets)) as pool:
+        outputs = pool.map(fit_models, tasks)
+
+    dfs = []
+    for label, start, betas, converged, metrics in outputs:
+        if not converged.all():
+            print(f'{label}: {(~converged).sum()} models starting at term {start} did not converge or were not fit')
+        df = pd.DataFrame({'GOid': GOids[start:start + len(betas)], 'label': label, 'converged': converged, **metrics,
+                           **{f'beta{i}': betas[:, i + 1] for i in range(betas.shape[1] - 1)}})  # Intercept is not written
+        dfs.append(df)
+    results = pd.concat(dfs)
+    results.to_csv('out/models.tsv', sep='\t', index=False)
@@ -7,7 +7,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from matplotlib.patches import Patch
-from src.GO.enrich import hypergeom_test
+from src.GO.enrich import get_incidence, get_selection, get_term_counts, hypergeom_sf
 
 ppid_regex = r'ppid=([A-Za-z0-9_.]+)'
 gnid_regex = r'gnid=([A-Za-z0-9_.]+)'
@@ -25,20 +25,17 @@ quantile = rates['score_fraction'].quantile(0.9, interpolation='higher')  # Capt
 
 reference_gaf = all_proteins.merge(gaf, how='inner', on=['OGid'])
 enrichment_keys = rates[rates['score_fraction'] > quantile].index.to_frame(index=False)  # False forces re-index
-enrichment_gaf = reference_gaf.merge(enrichment_keys, how='inner', on=['OGid'])
 
-terms = list(enrichment_gaf[['aspect', 'GOid', 'name']].drop_duplicates().itertuples(index=False, name=None))
-M = reference_gaf.groupby(['OGid']).ngroups
-N = enrichment_gaf.groupby(['OGid']).ngroups
+objects, terms, incidence = get_incidence(reference_gaf, ['OGid'])
+selection = get_selection(objects, [enrichment_keys])
+ks, M, ns, Ns = get_term_counts(incidence, selection)
+ks, N = ks[:, 0], Ns[0]
+idx = ks > 0  # Only test terms in enrichment set
+num_tests = idx.sum()
 
-rows = []
-for aspect, GOid, name in terms:
-    k = enrichment_gaf[enrichment_gaf['GOid'] == GOid].groupby(['OGid']).ngroups
-    n = reference_gaf[reference_gaf['GOid'] == GOid].groupby(['OGid']).ngroups
-    pvalue = hypergeom_test(k, M, n, N)
-    rows.append({'pvalue': pvalue, 'k': k, 'n': n,
-                 'aspect': aspect, 'GOid': GOid, 'name': name})
-pvalues = pd.DataFrame(rows).sort_values(by=['aspect', 'pvalue'], ignore_index=True)
+pvalues = pd.DataFrame({'pvalue': hypergeom_sf(ks[idx], M, ns[idx], N), 'k': ks[idx], 'n': ns[idx]})
+pvalues = pd.concat([pvalues, terms[idx].to_frame(index=False)], axis=1)
+pvalues = pvalues.sort_values(by=['aspect', 'pvalue'], ignore_index=True)
 
 if not os.path.exists('out/'):
     os.mkdir('out/')
@@ -48,7 +45,7 @@ with open('out/output_proteins.txt', 'w') as file:
     output = f"""\
     M (reference size): {M}
     N (enrichment size): {N}
-    Number of tests: {len(terms)}
+    Number of tests: {num_tests}
     """
     file.write(dedent(output))  # Remove leading whitespace
 
@@ -5,6 +5,7 @@ import re
 from itertools import groupby
 
 import numpy as np
+from src.intervals import get_overlap_lengths
 from utils import read_fasta
 
 
@@ -58,17 +59,21 @@ for OGid in sorted(OGid2regions):
     aligned_seq = record[1]
     unaligned_seq = aligned_seq.translate({ord('-'): None, ord('.'): None})
     offsets = np.concatenate([[0], np.cumsum([sym in ['-', '.'] for sym in aligned_seq])])  # Add initial of 0 so offsets don't include current index
-    domain_mask = np.zeros(len(unaligned_seq), dtype=bool)
-    for ali_from, ali_to in OGid2domains.get(OGid, []):  # If no domains, return empty list to prevent key error
-        domain_mask[ali_from:ali_to] = True
-
-    for aligned_start, aligned_stop, disorder in OGid2regions[OGid]:
-        unaligned_start = aligned_start - offsets[aligned_start]
-        unaligned_stop = aligned_stop - offsets[aligned_stop]
-        length = unaligned_stop - unaligned_start
-        overlap = domain_mask[unaligned_start: unaligned_stop].sum()
+
+    # Clip domains to sequence to match behavior of slicing
+    domains = np.array(OGid2domains.get(OGid, []), dtype=int).reshape(-1, 2)  # If no domains, return empty list to prevent key error
+    domains = np.clip(domains, 0, len(unaligned_seq))
+
+    regions = OGid2regions[OGid]
+    aligned_starts = np.array([aligned_start for aligned_start, _, _ in regions], dtype=int)
+    aligned_stops = np.array([aligned_stop for _, aligned_stop, _ in regions], dtype=int)
+    unaligned_starts = aligned_starts - offsets[aligned_starts]
+    unaligned_stops = aligned_stops - offsets[aligned_stops]
+    overlaps = get_overlap_lengths(unaligned_starts, unaligned_stops, domains[:, 0], domains[:, 1])
+
+    for (aligned_start, aligned_stop, disorder), unaligned_start, unaligned_stop, overlap in zip(regions, unaligned_starts, unaligned_stops, overlaps):
         record = {'OGid': OGid, 'start': aligned_start, 'stop': aligned_stop, 'disorder': disorder,
-                  'length': length, 'overlap': overlap}
+                  'length': unaligned_stop - unaligned_start, 'overlap': overlap}
         records.append(record)
 
 if not os.path.exists('out/'):
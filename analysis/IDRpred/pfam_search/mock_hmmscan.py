@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""Stand-in for hmmscan which writes a domain table without searching a database.
+
+The arguments are parsed as in the call in pfam_search.py, i.e. the path
+given by --domtblout is written and the query FASTA is the last argument.
+The table has the header and footer comments of an hmmscan domain table
+and one hit per query named by the first word of its header. Use it by
+setting the HMMSCAN_PATH environment variable to the path of this script.
+"""
+
+import sys
+
+header = """\
+#                                                                            --- full sequence --- -------------- this domain -------------   hmm coord   ali coord   env coord
+# target name        accession   tlen query name           accession   qlen   E-value  score  bias   #  of  c-Evalue  i-Evalue  score  bias  from    to  from    to  from    to  acc description of target
+#------------------- ---------- ----- -------------------- ---------- ----- --------- ------ ----- --- --- --------- --------- ------ ----- ----- ----- ----- ----- ----- ----- ---- ---------------------
+"""
+footer = """\
+#
+# Program:         hmmscan
+# Version:         mock
+# Pipeline mode:   SCAN
+# Query file:      {query_path}
+# Target file:     {target_path}
+# Option settings: {options}
+# [ok]
+"""
+
+args = sys.argv[1:]
+domtbl_path = args[args.index('--domtblout') + 1]
+target_path, query_path = args[-2], args[-1]
+
+names = []
+with open(query_path) as file:
+    for line in file:
+        if line.startswith('>'):
+            names.append(line[1:].split()[0])
+
+with open(domtbl_path, 'w') as file:
+    file.write(header)
+    for name in names:
+        file.write(f'MockDomain           PF00000.1     100 {name:<20} -             100   1.0e-20   70.0   0.1   1   1   1.0e-24   1.0e-20   70.0   0.1     1   100     1   100     1   100 0.99 Mock domain\n')
+    file.write(footer.format(query_path=query_path, target_path=target_path, options=' '.join(sys.argv)))
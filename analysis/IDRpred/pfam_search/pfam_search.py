@@ -1,42 +1,97 @@
 """Search alignment sequences against Pfam models."""
 
+import multiprocessing as mp
 import os
 import re
 from subprocess import run
 
 from src.utils import read_fasta
 
-spid_regex = r'spid=([a-z]+)'
-domE_cutoff = 1E-10  # Domain reporting threshold
 
-if not os.path.exists('out/'):
-    os.mkdir('out/')
-
-OGids = sorted([path.removesuffix('.afa') for path in os.listdir('../../../data/alignments/fastas/') if path.endswith('.afa')])
-for OGid in OGids:
-    record = None
-    for header, seq in read_fasta(f'../../../data/alignments/fastas/{OGid}.afa'):
-        spid = re.search(spid_regex, header).group(1)
-        if spid == 'dmel':
-            record = (header, seq)
-    if record is None:
-        raise RuntimeError(f'Alignment {OGid} does not have a sequence from dmel.')
-
-    with open(f'out/{OGid}_dmel_temp.fa', 'w') as file:
-        header, seq = record
-        seq = seq.translate({ord('-'): None, ord('.'): None})  # Remove gaps
-        seqstring = '\n'.join([seq[i:i+80] for i in range(0, len(seq), 80)])
-        file.write(f'{header}\n{seqstring}')
-
-    cmd = ['../../../bin/hmmscan',
+def search_chunk(args):
+    chunk_id, records = args
+    prefix = f'out/chunks/{chunk_id}'
+
+    name2OGid = {}
+    with open(f'{prefix}.fa', 'w') as file:
+        for OGid, header, seq in records:
+            name2OGid[header[1:].split()[0]] = OGid  # hmmscan identifies queries by first word of header
+            seq = seq.translate({ord('-'): None, ord('.'): None})  # Remove gaps
+            seqstring = '\n'.join([seq[i:i+80] for i in range(0, len(seq), 80)])
+            file.write(f'{header}\n{seqstring}\n')
+
+    cmd = [hmmscan_path,
            '--domE', str(domE_cutoff),
+           '--cpu', str(num_threads),
            '-o', '/dev/null',  # Discard output from STDIN
-           '--domtblout', f'out/{OGid}.txt',
+           '--domtblout', f'{prefix}.txt',
            '../../../data/Pfam/Pfam-A_36_0.hmm',
-           f'out/{OGid}_dmel_temp.fa']
+           f'{prefix}.fa']
     run(cmd, check=True)
 
-    os.remove(f'out/{OGid}_dmel_temp.fa')
+    # Split combined table into tables for each OGid
+    # Comment lines at the start and end of the table are copied to each file so they have the same format as a
+    # single query search. The header ends at the first hit or, if there are no hits, at the bare # line which
+    # begins the footer.
+    with open(f'{prefix}.txt') as file:
+        table_lines = file.readlines()
+    hit_idxs = [idx for idx, line in enumerate(table_lines) if not line.startswith('#')]
+    if hit_idxs:
+        header_stop, footer_start = hit_idxs[0], hit_idxs[-1] + 1
+    else:
+        header_stop = next((idx for idx, line in enumerate(table_lines) if line.rstrip('\n') == '#'), len(table_lines))
+        footer_start = header_stop
+    header_lines, footer_lines = table_lines[:header_stop], table_lines[footer_start:]
+
+    OGid2lines = {OGid: [] for OGid, _, _ in records}
+    for line in table_lines[header_stop:footer_start]:
+        OGid2lines[name2OGid[line.split(maxsplit=4)[3]]].append(line)  # Query name is fourth field
+
+    for OGid, lines in OGid2lines.items():
+        with open(f'out/{OGid}.txt.tmp', 'w') as file:
+            file.writelines(header_lines + lines + footer_lines)
+        os.replace(f'out/{OGid}.txt.tmp', f'out/{OGid}.txt')  # Rename on completion so partial tables are not skipped
+
+    os.remove(f'{prefix}.fa')
+    os.remove(f'{prefix}.txt')
+
+
+num_processes = int(os.environ.get('SLURM_CPUS_ON_NODE', 1))
+num_threads = 2  # Number of threads used by each hmmscan process
+hmmscan_path = os.environ.get('HMMSCAN_PATH', '../../../bin/hmmscan')
+
+spid_regex = r'spid=([a-z]+)'
+domE_cutoff = 1E-10  # Domain reporting threshold
+chunksize = 100  # Number of sequences in each hmmscan query file
+
+if __name__ == '__main__':
+    if not os.path.exists('out/chunks/'):
+        os.makedirs('out/chunks/')
+
+    # Load dmel sequences of OGids without tables
+    records = []
+    OGids = sorted([path.removesuffix('.afa') for path in os.listdir('../../../data/alignments/fastas/') if path.endswith('.afa')])
+    for OGid in OGids:
+        if os.path.exists(f'out/{OGid}.txt'):
+            continue
+        record = None
+        for header, seq in read_fasta(f'../../../data/alignments/fastas/{OGid}.afa'):
+            spid = re.search(spid_regex, header).group(1)
+            if spid == 'dmel':
+                record = (OGid, header, seq)
+        if record is None:
+            raise RuntimeError(f'Alignment {OGid} does not have a sequence from dmel.')
+        records.append(record)
+
+    names = [header[1:].split()[0] for _, header, _ in records]
+    if len(set(names)) != len(names):
+        raise RuntimeError('Sequences do not have unique names.')
+
+    # Search chunks in parallel
+    # Each hmmscan process loads the models once for its whole chunk rather than once per sequence
+    args = [(chunk_id, records[i:i+chunksize]) for chunk_id, i in enumerate(range(0, len(records), chunksize))]
+    with mp.Pool(processes=max(1, num_processes // num_threads)) as pool:
+        pool.map(search_chunk, args)
 
 """
 NOTES
@@ -51,4 +106,10 @@ metric would be an average confidence over all positions, which is actually less
 threshold the confidences to make them Boolean variables, but that basically brings us back to the single sequence
 comparison. I think because the Pfam models should already be highly sensitive, there's not much gained by trying to
 merge the results from searches against each sequence in the alignment.
+
+The sequences are searched in chunks to avoid loading the models for every sequence. Since hmmscan calculates E-values
+relative to the number of models in the database, the hits of each sequence are the same as when it is searched alone.
+Tables are written for each OGid as they complete, so OGids with tables are skipped if the search is restarted. The
+path to hmmscan can be set with the HMMSCAN_PATH environment variable to use a different installation. To test the
+driver without the Pfam database, set it to mock_hmmscan.py, which writes a table with one hit per query.
 """
\ No newline at end of file
@@ -2,6 +2,7 @@
 
 import os
 import re
+from itertools import product
 
 import scipy.ndimage as ndimage
 import numpy as np
@@ -66,6 +67,46 @@ def get_merged_slices(slices):
     return merged
 
 
+def get_segments(root_scores, cutoff_high, cutoff_low, min_length, structure_size):
+    """Return disorder and order slices from root scores.
+
+    Disorder seeds are runs of scores at or above cutoff_high which are at
+    least min_length long. Seeds are extended in both directions while the
+    dilation of the mask of scores at or above cutoff_low is True.
+
+    Parameters
+    ----------
+    root_scores: ndarray
+    cutoff_high: float
+    cutoff_low: float
+    min_length: int
+    structure_size: int
+        Length of structuring element for dilation of cutoff_low mask.
+
+    Returns
+    -------
+    disorder_slices: list of slice
+    order_slices: list of slice
+    """
+    slices = []
+    binary1 = root_scores >= cutoff_high
+    binary2 = ndimage.binary_dilation(root_scores >= cutoff_low, structure=np.ones(structure_size))
+    for s, in ndimage.find_objects(ndimage.label(binary1)[0]):
+        if s.stop - s.start < min_length:
+            continue
+
+        start = s.start
+        while start-1 >= 0 and binary2[start-1]:
+            start -= 1
+        stop = s.stop
+        while stop+1 <= len(root_scores) and binary2[stop]:
+            stop += 1
+        slices.append(slice(start, stop))
+    disorder_slices = get_merged_slices(slices)
+    order_slices = get_complement_slices(disorder_slices, stop=len(root_scores))
+    return disorder_slices, order_slices
+
+
 def load_scores(path):
     with open(path) as file:
         scores = []
@@ -84,6 +125,15 @@ cutoff_low = 0.4
 min_length = 10
 structure = np.ones(3)
 
+# Parameter sweep
+# Root scores are calculated once per OGid, and the regions for every combination of parameters are segmented from
+# them in the same pass. Regions for each combination are written to out/sweep/
+sweep = False
+cutoff_highs = [0.5, 0.6, 0.7]
+cutoff_lows = [0.3, 0.4, 0.5]
+min_lengths = [10, 20, 30]
+structure_sizes = [1, 3, 5]
+
 tree_template = skbio.read('../../../data/trees/consensus_LG/100R_NI.nwk', 'newick', skbio.TreeNode)
 tip_order = {tip.name: i for i, tip in enumerate(tree_template.tips())}
 
@@ -105,7 +155,15 @@ for OGid, error_flags in sorted(OGid2flags.items()):
     if not any(error_flags):
         OGids.append(OGid)
 
-records = []
+# Make parameter sets
+params = (cutoff_high, cutoff_low, min_length, len(structure))
+param_sets = [params]
+if sweep:
+    for param_set in product(cutoff_highs, cutoff_lows, min_lengths, structure_sizes):
+        if param_set[1] <= param_set[0] and param_set not in param_sets:  # Low cutoff cannot exceed high cutoff
+            param_sets.append(param_set)
+
+record_sets = {param_set: [] for param_set in param_sets}
 for OGid in OGids:
     # Load MSA
     msa = []
@@ -162,33 +220,25 @@ for OGid in OGids:
     weight_sum = (weight_array * ~aligned_scores.mask).sum(axis=0)
     root_scores = (weight_array * aligned_scores).sum(axis=0) / weight_sum
 
-    slices = []
-    binary1 = root_scores >= cutoff_high
-    binary2 = ndimage.binary_dilation(root_scores >= cutoff_low, structure=structure)
-    for s, in ndimage.find_objects(ndimage.label(binary1)[0]):
-        if s.stop - s.start < min_length:
-            continue
-
-        start = s.start
-        while start-1 >= 0 and binary2[start-1]:
-            start -= 1
-        stop = s.stop
-        while stop+1 <= len(root_scores) and binary2[stop]:
-            stop += 1
-        slices.append(slice(start, stop))
-    disorder_slices = get_merged_slices(slices)
-    order_slices = get_complement_slices(disorder_slices, stop=len(root_scores))
-
-    for s in disorder_slices:
-        records.append((OGid, s.start, s.stop, True))
-    for s in order_slices:
-        records.append((OGid, s.start, s.stop, False))
+    for param_set, records in record_sets.items():
+        disorder_slices, order_slices = get_segments(root_scores, *param_set)
+        for s in disorder_slices:
+            records.append((OGid, s.start, s.stop, True))
+        for s in order_slices:
+            records.append((OGid, s.start, s.stop, False))
 
 # Write segments to file
 if not os.path.exists('out/'):
     os.mkdir('out/')
+if sweep and not os.path.exists('out/sweep/'):
+    os.mkdir('out/sweep/')
 
-with open('out/regions.tsv', 'w') as file:
-    file.write('OGid\tstart\tstop\tdisorder\n')
-    for record in sorted(records, key=lambda x: (x[0], x[1])):
-        file.write('\t'.join([str(field) for field in record]) + '\n')
+for param_set, records in record_sets.items():
+    if param_set == params:
+        path = 'out/regions.tsv'
+    else:
+        path = 'out/sweep/regions_{}_{}_{}_{}.tsv'.format(*param_set)
+    with open(path, 'w') as file:
+        file.write('OGid\tstart\tstop\tdisorder\n')
+        for record in sorted(records, key=lambda x: (x[0], x[1])):
+            file.write('\t'.join([str(field) for field in record]) + '\n')
@@ -3,10 +3,26 @@
 import re
 import os
 
+import numpy as np
+from src.intervals import get_overlaps
 from src.utils import read_fasta
 
 
-def spid_filter(spids):
+def spid_filter(presences, spids):
+    """Return array indicating if sets of species pass phylogenetic diversity filter.
+
+    Parameters
+    ----------
+    presences: ndarray
+        Boolean array where the last axis indicates if the species at the
+        corresponding index in spids is present in the set.
+    spids: list of str
+
+    Returns
+    -------
+    passes: ndarray
+        Boolean array with the shape of presences without its last axis.
+    """
     conditions = [({'dnov', 'dvir'}, 1),
                   ({'dmoj', 'dnav'}, 1),
                   ({'dinn', 'dgri', 'dhyd'}, 2),
@@ -19,27 +35,20 @@ def spid_filter(spids):
                   ({'dsan', 'dyak'}, 1),
                   ({'dmel'}, 1),
                   ({'dmau', 'dsim', 'dsec'}, 1)]
-    return all([len(spids & group) >= num for group, num in conditions])
-
-
-def has_overlap(start1, stop1, start2, stop2):
-    if stop1 < start1:
-        raise ValueError('stop1 < start1')
-    if stop2 < start2:
-        raise ValueError('stop2 < start2')
-    if start1 == stop1 or start2 == stop2:
-        return False
-    if stop2 < stop1:
-        start1, start2 = start2, start1
-        stop1, stop2 = stop2, stop1
-    return stop1 > start2
+    groups = np.array([[spid in group for group, _ in conditions] for spid in spids]).reshape(len(spids), len(conditions))
+    nums = np.array([num for _, num in conditions])
+    counts = presences.astype(int) @ groups.astype(int)
+    return (counts >= nums).all(axis=-1)
 
 
 ppid_regex = r'ppid=([A-Za-z0-9_.]+)'
 spid_regex = r'spid=([a-z]+)'
 
 spid_min = 20
+min_lengths = np.arange(10, 105, 5)
 alphabet = {'A', 'R', 'N', 'D', 'C', 'Q', 'E', 'G', 'H', 'I', 'L', 'K', 'M', 'F', 'P', 'S', 'T', 'W', 'Y', 'V', '-', '.'}
+alphabet_codes = np.frombuffer(''.join(alphabet).encode(), dtype=np.uint8)
+gap_codes = np.frombuffer(b'-.', dtype=np.uint8)
 
 # Load regions
 OGid2regions = {}
@@ -54,7 +63,7 @@ with open('../region_compute/out/regions.tsv') as file:
             OGid2regions[OGid] = [(start, stop, disorder)]
 
 # Filter regions
-record_sets = {min_length: [] for min_length in range(10, 105, 5)}
+record_sets = {min_length: [] for min_length in min_lengths}
 for OGid, regions in OGid2regions.items():
     # Load MSA
     msa = []
@@ -76,31 +85,38 @@ for OGid, regions in OGid2regions.items():
                     missing.append((int(start), int(stop)))
             ppid2missing[fields['ppid']] = missing
 
-    for region_start, region_stop, disorder in regions:
-        # Extract and filter segments
-        segment_sets = {min_length: [] for min_length in record_sets}
-        for record in msa:
-            ppid, spid, segment = record['ppid'], record['spid'], record['seq'][region_start:region_stop]
-
-            # Filter by length, symbols, and overlap with missing trims
-            length, is_standard = 0, True
-            for sym in segment:
-                if sym not in ['-', '.']:
-                    length += 1
-                if sym not in alphabet:
-                    is_standard = False
-            no_overlaps = []
-            for missing_start, missing_stop in ppid2missing[ppid]:
-                no_overlaps.append(not has_overlap(region_start, region_stop, missing_start, missing_stop))
-            for min_length, segments in segment_sets.items():
-                if length >= min_length and is_standard and all(no_overlaps):
-                    segments.append((ppid, spid))
-
-        # Filter by phylogenetic diversity
-        for min_length, segments in segment_sets.items():
-            ppids = [ppid for ppid, _ in segments]
-            spids = {spid for _, spid in segments}
-            if len(spids) >= spid_min and spid_filter(spids):
+    # Encode MSA and calculate cumulative counts of non-gap and non-standard symbols
+    codes = np.frombuffer(''.join([record['seq'] for record in msa]).encode(), dtype=np.uint8).reshape(len(msa), -1)
+    zeros = np.zeros((len(msa), 1), dtype=int)
+    length_sums = np.concatenate([zeros, np.cumsum(~np.isin(codes, gap_codes), axis=1)], axis=1)
+    nonstandard_sums = np.concatenate([zeros, np.cumsum(~np.isin(codes, alphabet_codes), axis=1)], axis=1)
+
+    # Filter segments by length, symbols, and overlap with missing trims
+    # Arrays have shape (number of sequences, number of regions)
+    region_starts = np.array([region_start for region_start, _, _ in regions])
+    region_stops = np.array([region_stop for _, region_stop, _ in regions])
+    lengths = length_sums[:, region_stops] - length_sums[:, region_starts]
+    is_standards = (nonstandard_sums[:, region_stops] - nonstandard_sums[:, region_starts]) == 0
+    no_overlaps = np.empty_like(is_standards)
+    for i, record in enumerate(msa):
+        missing = np.array(ppid2missing[record['ppid']], dtype=int).reshape(-1, 2)
+        no_overlaps[i] = ~get_overlaps(region_starts, region_stops, missing[:, 0], missing[:, 1])
+
+    # Count thresholds passed by each segment
+    # Since the thresholds are sorted, a segment passes the first num_passed thresholds
+    num_passed = np.searchsorted(min_lengths, lengths, side='right') * (is_standards & no_overlaps)
+    passes = np.arange(len(min_lengths)).reshape(-1, 1, 1) < num_passed  # Shape (thresholds, sequences, regions)
+
+    # Filter by phylogenetic diversity
+    spids = sorted({record['spid'] for record in msa})
+    spid_matrix = np.array([[record['spid'] == spid for spid in spids] for record in msa])
+    presences = np.einsum('tir,is->trs', passes.astype(int), spid_matrix.astype(int)) > 0  # Shape (thresholds, regions, species)
+    keeps = (presences.sum(axis=-1) >= spid_min) & spid_filter(presences, spids)
+
+    for j, (region_start, region_stop, disorder) in enumerate(regions):
+        for t, min_length in enumerate(min_lengths):
+            if keeps[t, j]:
+                ppids = [record['ppid'] for record, is_passed in zip(msa, passes[t, :, j]) if is_passed]
                 record_sets[min_length].append((OGid, str(region_start), str(region_stop), str(disorder), ','.join(ppids)))
 
 # Write records to file
@@ -6,41 +6,45 @@ import re
 
 import pandas as pd
 import skbio
+from src.brownian.regions import get_region_layout, get_tip_order
+from src.shared import SharedArray
 from src.phylo import get_contrasts
 from src.utils import read_fasta
 
 
-def get_args(grouped, tree, feature_labels, group_labels):
-    for name, group in grouped:
-        yield name, group, tree, feature_labels, group_labels
+def init_worker(spec, subsets):
+    """Set arrays of regions as globals in worker processes."""
+    global shared_values, feature_values, subset_spids, subset2data
+    shared_values = SharedArray.attach(spec)  # Keep reference so view is not released
+    feature_values, subset_spids = shared_values.array, subsets
+    subset2data = {}
+
+
+def get_subset_data(subset_id):
+    """Return tree and tip order of species subset, calculating only once per worker."""
+    try:
+        return subset2data[subset_id]
+    except KeyError:
+        spids = subset_spids[subset_id]
+        tree = tree_template.shear(spids)
+        idx = get_tip_order(tree.tips(), spids)
+        subset2data[subset_id] = tree, idx
+        return subset2data[subset_id]
 
 
 def apply_contrasts(args):
-    name, group, tree, feature_labels, group_labels = args
-    OGid, start, stop, disorder = name
+    _, row_start, row_stop, subset_id = args
 
     # Map features to tips
-    tree = tree.shear(group['spid'])
-    spid2idx = {spid: idx for idx, spid in zip(group.index, group['spid'])}
-    for tip in tree.tips():
-        idx = spid2idx[tip.name]
-        tip.value = group.loc[idx, feature_labels]
+    tree, idx = get_subset_data(subset_id)
+    region_values = feature_values[row_start:row_stop][idx]  # Rows in order of tips
+    for tip, values in zip(tree.tips(), region_values):
+        tip.value = values
 
     # Get contrasts
-    roots, contrasts = get_contrasts(tree)
-
-    # Convert to dataframes
-    root_ids = pd.Series({'OGid': OGid, 'start': start, 'stop': stop})
-    roots = pd.concat([root_ids, roots])
-    roots.index = pd.MultiIndex.from_arrays([roots.index, 3*['ids_group'] + group_labels])
+    root, contrasts = get_contrasts(tree)
 
-    contrast_ids = []
-    for contrast_id in range(len(contrasts)):
-        contrast_ids.append({'OGid': OGid, 'start': start, 'stop': stop, 'contrast_id': contrast_id})
-    contrasts = pd.concat([pd.DataFrame(contrast_ids), pd.DataFrame(contrasts)], axis=1)
-    contrasts.columns = pd.MultiIndex.from_arrays([contrasts.columns, 4*['ids_group'] + group_labels])
-
-    return roots, contrasts
+    return root, contrasts
 
 
 num_processes = int(os.environ.get('SLURM_CPUS_ON_NODE', 10))
@@ -94,10 +98,26 @@ if __name__ == '__main__':
         regions = features.groupby(['OGid', 'start', 'stop', 'disorder'])
 
         # Apply contrasts
-        args = get_args(regions, tree_template, feature_labels, group_labels)
-        with mp.Pool(processes=num_processes) as pool:
-            records = pool.map(apply_contrasts, args, chunksize=50)
-
-        roots, contrasts = zip(*records)
-        pd.DataFrame(roots).to_csv(f'out/features/roots_{min_length}.tsv', sep='\t', index=False)
-        pd.concat(contrasts).to_csv(f'out/features/contrasts_{min_length}.tsv', sep='\t', index=False)
+        # Regions are passed to workers as blocks of rows in a feature matrix in shared memory, so tasks are only
+        # tuples of integers and workers do not copy the matrix
+        names, values, subsets, tasks = get_region_layout(regions, feature_labels)
+        with SharedArray.publish(values, feature_labels) as shared_values:
+            initargs = (shared_values.spec, subsets)
+            with mp.Pool(processes=num_processes, initializer=init_worker, initargs=initargs) as pool:
+                records = pool.map(apply_contrasts, tasks, chunksize=50)
+
+        # Convert to dataframes
+        roots, contrasts = [], []
+        for (OGid, start, stop, _), (root, region_contrasts) in zip(names, records):
+            roots.append([OGid, start, stop, *root])
+            for contrast_id, contrast in enumerate(region_contrasts):
+                contrasts.append([OGid, start, stop, contrast_id, *contrast])
+        columns = pd.MultiIndex.from_arrays([['OGid', 'start', 'stop'] + feature_labels,
+                                             3*['ids_group'] + group_labels])
+        roots = pd.DataFrame(roots, columns=columns)
+        columns = pd.MultiIndex.from_arrays([['OGid', 'start', 'stop', 'contrast_id'] + feature_labels,
+                                             4*['ids_group'] + group_labels])
+        contrasts = pd.DataFrame(contrasts, columns=columns)
+
+        roots.to_csv(f'out/features/roots_{min_length}.tsv', sep='\t', index=False)
+        contrasts.to_csv(f'out/features/contrasts_{min_length}.tsv', sep='\t', index=False)
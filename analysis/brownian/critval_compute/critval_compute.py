@@ -0,0 +1,95 @@
+"""Calculate critical values of OU vs BM likelihood ratios on the trees of regions."""
+
+import multiprocessing as mp
+import os
+import re
+
+import numpy as np
+import skbio
+from src.brownian.simulate.critvals import get_critvals, get_subset_key, get_subset_seed
+from src.utils import read_fasta
+
+
+def get_subset_critvals(key):
+    spids = key.split(',')
+    tree = tree_template.shear(spids)
+    rng = np.random.default_rng(get_subset_seed(seed, key))
+    q95, q99 = get_critvals(tree, num_samples, rng, quantiles=(0.95, 0.99))
+    return key, q95, q99
+
+
+num_processes = int(os.environ.get('SLURM_CPUS_ON_NODE', 1))
+
+ppid_regex = r'ppid=([A-Za-z0-9_.]+)'
+spid_regex = r'spid=([a-z]+)'
+min_lengths = [30, 60, 90]
+
+num_samples = 10000
+seed = 1
+
+tree_template = skbio.read('../../../data/trees/consensus_LG/100R_NI.nwk', 'newick', skbio.TreeNode)
+
+if __name__ == '__main__':
+    # Load sequence data
+    ppid2spid = {}
+    OGids = sorted([path.removesuffix('.afa') for path in os.listdir('../../../data/alignments/fastas/') if path.endswith('.afa')])
+    for OGid in OGids:
+        for header, _ in read_fasta(f'../../../data/alignments/fastas/{OGid}.afa'):
+            ppid = re.search(ppid_regex, header).group(1)
+            spid = re.search(spid_regex, header).group(1)
+            ppid2spid[ppid] = spid
+
+    # Load regions and their species subsets
+    min_length2regions = {}
+    for min_length in min_lengths:
+        regions = []
+        with open(f'../../IDRpred/region_filter/out/regions_{min_length}.tsv') as file:
+            field_names = file.readline().rstrip('\n').split('\t')
+            for line in file:
+                fields = {key: value for key, value in zip(field_names, line.rstrip('\n').split('\t'))}
+                OGid, start, stop = fields['OGid'], int(fields['start']), int(fields['stop'])
+                key = get_subset_key([ppid2spid[ppid] for ppid in fields['ppids'].split(',')])
+                regions.append((OGid, start, stop, key))
+        min_length2regions[min_length] = regions
+
+    # Load cached critical values
+    # Subsets are cached with the number of samples and seed used to calculate them, so changing either recalculates
+    # all subsets
+    if not os.path.exists('out/'):
+        os.mkdir('out/')
+
+    key2critvals = {}
+    if os.path.exists('out/critvals.tsv'):
+        with open('out/critvals.tsv') as file:
+            field_names = file.readline().rstrip('\n').split('\t')
+            for line in file:
+                fields = {key: value for key, value in zip(field_names, line.rstrip('\n').split('\t'))}
+                if int(fields['num_samples']) == num_samples and int(fields['seed']) == seed:
+                    key2critvals[fields['spids']] = (float(fields['q95']), float(fields['q99']))
+
+    # Calculate critical values of uncached subsets
+    keys = sorted({key for regions in min_length2regions.values() for *_, key in regions} - set(key2critvals))
+    with mp.Pool(processes=num_processes) as pool:
+        for key, q95, q99 in pool.imap_unordered(get_subset_critvals, keys):
+            key2critvals[key] = (q95, q99)
+
+    with open('out/critvals.tsv', 'w') as file:
+        file.write('spids\tnum_samples\tseed\tq95\tq99\n')
+        for key, (q95, q99) in sorted(key2critvals.items()):
+            file.write(f'{key}\t{num_samples}\t{seed}\t{q95}\t{q99}\n')
+
+    # Write critical values of regions
+    for min_length, regions in min_length2regions.items():
+        with open(f'out/regions_{min_length}.tsv', 'w') as file:
+            file.write('OGid\tstart\tstop\tq95\tq99\n')
+            for OGid, start, stop, key in regions:
+                q95, q99 = key2critvals[key]
+                file.write(f'{OGid}\t{start}\t{stop}\t{q95}\t{q99}\n')
+
+"""
+NOTES
+The null distribution of the likelihood ratio depends on the tree, so a single set of critical values calculated on
+the full tree is not appropriate for regions where only a subset of species is present. Critical values are instead
+calculated for each distinct species subset by simulating under BM on the sheared tree. Since the likelihood ratio is
+invariant to the scale of the data, the simulations use sigma2 = 1.
+"""
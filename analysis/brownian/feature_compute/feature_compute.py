@@ -6,20 +6,29 @@ import re
 from collections import namedtuple
 
 import src.brownian.features as features
+from src.shared import SharedArray
 from src.utils import read_fasta
 
 
 ArgsRecord = namedtuple('ArgsRecord', ['OGid', 'start', 'stop', 'ppid', 'disorder', 'segment'])
 
 
+def is_valid(segment):
+    return not (len(segment) == 0 or 'X' in segment or 'U' in segment)
+
+
+def init_worker(spec):
+    """Set output array as global in worker processes."""
+    global shared_features
+    shared_features = SharedArray.attach(spec)
+
+
 def get_features(args):
-    record = {('OGid', 'ids_group'): args.OGid,
-              ('start', 'ids_group'): args.start,
-              ('stop', 'ids_group'): args.stop,
-              ('ppid', 'ids_group'): args.ppid}
-    if not (len(args.segment) == 0 or 'X' in args.segment or 'U' in args.segment):
-        record.update(features.get_features(args.segment, features.repeat_groups, features.motif_regexes))
-    return record
+    """Write features of segment to its row of the shared output array."""
+    idx, segment = args
+    if is_valid(segment):
+        record = features.get_features(segment, features.repeat_groups, features.motif_regexes)
+        shared_features.array[idx] = [record[label] for label in shared_features.labels]
 
 
 num_processes = int(os.environ.get('SLURM_CPUS_ON_NODE', 1))
@@ -49,18 +58,30 @@ if __name__ == '__main__':
                 segment = seq[start:stop].translate({ord('-'): None, ord('.'): None})
                 args.append(ArgsRecord(OGid, start, stop, ppid, disorder, segment))
 
+    # Get labels of features from first valid segment
+    labels = []
+    for arg in args:
+        if is_valid(arg.segment):
+            labels = list(features.get_features(arg.segment, features.repeat_groups, features.motif_regexes))
+            break
+
     # Calculate features
-    with mp.Pool(processes=num_processes) as pool:
-        records = pool.map(get_features, args, chunksize=50)
+    # Workers write features directly into rows of an array in shared memory, so records are not returned through
+    # the pool. Rows of invalid segments remain nan.
+    with SharedArray.empty((len(args), len(labels)), labels) as shared_features:
+        tasks = [(idx, arg.segment) for idx, arg in enumerate(args)]
+        with mp.Pool(processes=num_processes, initializer=init_worker, initargs=(shared_features.spec,)) as pool:
+            pool.map(get_features, tasks, chunksize=50)
+        values = shared_features.array.copy()
 
     # Write features to file
     if not os.path.exists('out/'):
         os.mkdir('out/')
 
     with open('out/features.tsv', 'w') as file:
-        if records:
-            field_names = list(records[0])
-            file.write('\t'.join([feature_label for feature_label, _ in field_names]) + '\n')
-            file.write('\t'.join([group_label for _, group_label in field_names]) + '\n')
-        for record in records:
-            file.write('\t'.join(str(record.get(field_name, 'nan')) for field_name in field_names) + '\n')
+        field_names = [('OGid', 'ids_group'), ('start', 'ids_group'), ('stop', 'ids_group'), ('ppid', 'ids_group')] + labels
+        file.write('\t'.join([feature_label for feature_label, _ in field_names]) + '\n')
+        file.write('\t'.join([group_label for _, group_label in field_names]) + '\n')
+        for arg, row in zip(args, values):
+            fields = [arg.OGid, arg.start, arg.stop, arg.ppid, *row]
+            file.write('\t'.join(str(field) for field in fields) + '\n')
@@ -1,43 +1,77 @@
 """Fit models of evolution to features at tips."""
 
+import hashlib
 import multiprocessing as mp
 import os
+import pickle
 import re
 
 import numpy as np
 import pandas as pd
 import skbio
 import src.phylo as phylo
+from src.brownian.regions import get_region_layout, get_tip_order
+from src.shared import SharedArray
 from src.utils import read_fasta
 
 
-def get_args(grouped, tree, feature_labels, group_labels):
-    for name, group in grouped:
-        yield name, group, tree, feature_labels, group_labels
+def init_worker(names, spec, subsets, labels):
+    """Set arrays of regions as globals in worker processes."""
+    global region_names, shared_values, feature_values, subset_spids, feature_labels, group_labels, subset2data
+    region_names, subset_spids = names, subsets
+    shared_values = SharedArray.attach(spec)  # Keep reference so view is not released
+    feature_values, feature_labels = shared_values.array, shared_values.labels
+    group_labels = labels
+    subset2data = {}
+
+
+def get_subset_data(subset_id):
+    """Return tips, covariance matrix, its inverse, and tip order of species subset, calculating only once per worker."""
+    try:
+        return subset2data[subset_id]
+    except KeyError:
+        spids = subset_spids[subset_id]
+        tree = tree_template.shear(spids)
+        tips, cov = phylo.get_brownian_covariance(tree)
+        inv = np.linalg.inv(cov)
+        idx = get_tip_order(tips, spids)
+        subset2data[subset_id] = tips, cov, inv, idx
+        return subset2data[subset_id]
+
+
+def get_fit_key(name, group, feature_labels):
+    """Return key identifying the inputs of a region's fits.
+
+    The key is the region key, the set of species, and a hash of the feature
+    values ordered by species. Regions with the same key have identical fits,
+    so the key is used to reuse fits across min_lengths and runs.
+    """
+    group = group.sort_values('spid')
+    h = hashlib.sha256()
+    h.update('\t'.join(feature_labels).encode())
+    h.update(group[feature_labels].to_numpy(dtype=float).tobytes())
+    return name, tuple(group['spid']), h.hexdigest()
 
 
 def get_models(args):
     # Unpack variables
-    name, group, tree, feature_labels, group_labels = args
-    OGid, start, stop, disorder = name
+    region_id, row_start, row_stop, subset_id = args
+    OGid, start, stop, disorder = region_names[region_id]
 
     # Calculate some common quantities for all features
-    spid2idx = {spid: idx for idx, spid in zip(group.index, group['spid'])}
-    tree = tree.shear(group['spid'])
-    tips, cov = phylo.get_brownian_covariance(tree)
-    inv = np.linalg.inv(cov)
+    tips, cov, inv, idx = get_subset_data(subset_id)
+    region_values = feature_values[row_start:row_stop][idx]  # Rows in order of tips
 
     record = {('OGid', 'ids_group'): OGid,
               ('start', 'ids_group'): start,
               ('stop', 'ids_group'): stop}
-    for feature_label, group_label in zip(feature_labels, group_labels):
+    for j, (feature_label, group_label) in enumerate(zip(feature_labels, group_labels)):
         # Assign values to tips and extract vector
         # This is done in two ways because the MLE functions have different call signatures
         # as a result of some technical details relating to how they are implemented
-        for tip in tips:
-            idx = spid2idx[tip.name]
-            tip.value = group.loc[idx, feature_label]
-        values = np.array([tip.value for tip in tips])
+        values = region_values[:, j]
+        for tip, value in zip(tips, values):
+            tip.value = value
 
         if np.allclose(values, values.mean(), rtol=0, atol=1E-10):  # Use only absolute tolerance
             # If values are constant the model behaviors are technically undefined.
@@ -116,15 +150,50 @@ if __name__ == '__main__':
     if not os.path.exists('out/'):
         os.mkdir('out/')
 
+    # Load cache of previous fits
+    if os.path.exists('out/cache.pickle'):
+        with open('out/cache.pickle', 'rb') as file:
+            cache = pickle.load(file)
+    else:
+        cache = {}
+
+    # Group regions and identify fits not in cache
+    # The region sets of the min_lengths are largely nested, so each unique fit is computed once and shared
+    min_length2keys = {}
+    key2args = {}
     for min_length in min_lengths:
         segment_keys = all_segments[all_segments['min_length'] == min_length].drop('min_length', axis=1)
         features = segment_keys.merge(all_features, how='left', on=['OGid', 'start', 'stop', 'ppid'])
         regions = features.groupby(['OGid', 'start', 'stop', 'disorder'])
 
-        args = get_args(regions, tree_template, feature_labels, group_labels)
-        with mp.Pool(processes=num_processes) as pool:
-            records = pool.map(get_models, args, chunksize=10)
-
+        keys = []
+        for name, group in regions:
+            key = get_fit_key(name, group, feature_labels)
+            if key not in cache and key not in key2args:
+                key2args[key] = (name, group)
+            keys.append(key)
+        min_length2keys[min_length] = keys
+
+    # Fit models
+    # Regions are passed to workers as blocks of rows in a feature matrix in shared memory, so tasks are only tuples
+    # of integers and workers do not copy the matrix
+    names, values, subsets, tasks = get_region_layout(key2args.values(), feature_labels)
+    with SharedArray.publish(values, feature_labels) as shared_values:
+        initargs = (names, shared_values.spec, subsets, group_labels)
+        with mp.Pool(processes=num_processes, initializer=init_worker, initargs=initargs) as pool:
+            records = pool.map(get_models, tasks, chunksize=10)
+    cache.update(zip(key2args, records))
+
+    with open('out/cache.pickle.tmp', 'wb') as file:
+        pickle.dump(cache, file)
+    os.replace('out/cache.pickle.tmp', 'out/cache.pickle')
+
+    num_total = sum([len(keys) for keys in min_length2keys.values()])
+    print(f'{num_total} regions: {len(key2args)} fit, {num_total - len(key2args)} skipped')
+
+    # Write models to file
+    for min_length, keys in min_length2keys.items():
+        records = [cache[key] for key in keys]
         with open(f'out/models_{min_length}.tsv', 'w') as file:
             if records:
                 field_names = list(records[0])
@@ -143,4 +212,8 @@ nearly one to the 15th or 16th decimal place. It's unclear why this happens, and
 investigated at the level of individual sequences. However, it's likely these sequences are near the boundaries where
 the definitions of kappa and omega break down, i.e. there are few residues belonging to either of the classes whose
 separation is measured by these features.
-"""
\ No newline at end of file
+
+The fits of each region are cached in out/cache.pickle under a key of the region, its species, and a hash of its
+feature values. A region is only refit if one of these changes, e.g. if its features are recalculated or its set of
+species changes. Deleting the cache forces all regions to be refit.
+"""
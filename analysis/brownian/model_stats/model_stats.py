@@ -1,6 +1,5 @@
 """Plot statistics from fitted evolutionary models."""
 
-import json
 import os
 
 import matplotlib.pyplot as plt
@@ -22,9 +21,6 @@ min_indel_columns = 5  # Indel rates below this value are set to 0
 min_aa_rate = 1
 min_indel_rate = 0.1
 
-with open('../simulate_stats/out/BM/critvals.json') as file:
-    critvals = json.load(file)
-
 pca_components = 10
 cmap1, cmap2 = plt.colormaps['Blues'], plt.colormaps['Oranges']
 color1, color2 = '#4e79a7', '#f28e2b'
@@ -63,6 +59,8 @@ for min_length in min_lengths:
     # Load models
     models = pd.read_table(f'../model_compute/out/models_{min_length}.tsv', header=[0, 1])
     models = region_keys.merge(models.droplevel(1, axis=1), how='left', on=['OGid', 'start', 'stop'])
+    critvals = pd.read_table(f'../critval_compute/out/regions_{min_length}.tsv')
+    models = models.merge(critvals, how='left', on=['OGid', 'start', 'stop'])
     models = models.set_index(['OGid', 'start', 'stop', 'disorder'])
 
     # Extract labels
@@ -90,6 +88,11 @@ for min_length in min_lengths:
         columns[f'{feature_label}_delta_loglikelihood'] = models[f'{feature_label}_loglikelihood_OU'] - models[f'{feature_label}_loglikelihood_BM']
     models = pd.concat([models, pd.DataFrame(columns)], axis=1)
 
+    # Call significance with critical values of each region's tree
+    column_labels = [f'{feature_label}_delta_loglikelihood' for feature_label in feature_labels]
+    significant_95 = models[column_labels].gt(models['q95'], axis=0)
+    significant_99 = models[column_labels].gt(models['q99'], axis=0)
+
     # ASR rate histogram with cutoff
     fig, axs = plt.subplots(2, 1, gridspec_kw={'right': 0.825, 'top': 0.99, 'bottom': 0.1, 'hspace': 0.25})
 
@@ -112,8 +115,8 @@ for min_length in min_lengths:
 
     # Bar graph of fraction of regions with a significant feature
     column_labels = [f'{feature_label}_delta_loglikelihood' for feature_label in feature_labels]
-    ys_95 = (models.loc[pdidx[:, :, :, True], column_labels] > critvals['q95']).mean()
-    ys_99 = (models.loc[pdidx[:, :, :, True], column_labels] > critvals['q99']).mean()
+    ys_95 = significant_95.loc[pdidx[:, :, :, True], column_labels].mean()
+    ys_99 = significant_99.loc[pdidx[:, :, :, True], column_labels].mean()
     xs = list(range(len(column_labels)))
     xs_labels = [label.removesuffix('_delta_loglikelihood') for label in column_labels]
 
@@ -132,8 +135,8 @@ for min_length in min_lengths:
 
     # Bar graph of fraction of regions with a significant feature
     column_labels = [f'{feature_label}_delta_loglikelihood' for feature_label in feature_labels]
-    ys_95 = (models.loc[pdidx[:, :, :, True], column_labels] > critvals['q95']).sum().transform(lambda x: x/x.sum())
-    ys_99 = (models.loc[pdidx[:, :, :, True], column_labels] > critvals['q99']).sum().transform(lambda x: x/x.sum())
+    ys_95 = significant_95.loc[pdidx[:, :, :, True], column_labels].sum().transform(lambda x: x/x.sum())
+    ys_99 = significant_99.loc[pdidx[:, :, :, True], column_labels].sum().transform(lambda x: x/x.sum())
     xs = list(range(len(column_labels)))
     xs_labels = [label.removesuffix('_delta_loglikelihood') for label in column_labels]
 
@@ -157,13 +160,13 @@ for min_length in min_lengths:
     rng = np.random.default_rng(1)
     column_labels = [f'{feature_label}_delta_loglikelihood' for feature_label in feature_labels]
 
-    counts_95 = (models.loc[pdidx[:, :, :, True], column_labels] > critvals['q95']).sum(axis=1).value_counts()
-    shuffle_95 = rng.permuted((models.loc[pdidx[:, :, :, True], column_labels] > critvals['q95']).to_numpy(), axis=0)
+    counts_95 = significant_95.loc[pdidx[:, :, :, True], column_labels].sum(axis=1).value_counts()
+    shuffle_95 = rng.permuted(significant_95.loc[pdidx[:, :, :, True], column_labels].to_numpy(), axis=0)
     xs_95, ys_95 = np.unique(shuffle_95.sum(axis=1), return_counts=True)
     p_95 = shuffle_95.mean()
 
-    counts_99 = (models.loc[pdidx[:, :, :, True], column_labels] > critvals['q99']).sum(axis=1).value_counts()
-    shuffle_99 = rng.permuted((models.loc[pdidx[:, :, :, True], column_labels] > critvals['q99']).to_numpy(), axis=0)
+    counts_99 = significant_99.loc[pdidx[:, :, :, True], column_labels].sum(axis=1).value_counts()
+    shuffle_99 = rng.permuted(significant_99.loc[pdidx[:, :, :, True], column_labels].to_numpy(), axis=0)
     xs_99, ys_99 = np.unique(shuffle_99.sum(axis=1), return_counts=True)
     p_99 = shuffle_99.mean()
 
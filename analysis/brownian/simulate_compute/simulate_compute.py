@@ -1,20 +1,83 @@
 """Simulate data under BM and OU models and calculate estimated parameters and likelihoods."""
 
+import hashlib
+import multiprocessing as mp
 import os
 from itertools import product
 
 import numpy as np
 import pandas as pd
-import scipy.stats as stats
 import skbio
 import src.phylo as phylo
 from src.brownian.simulate.sampling import num_samples, seed
 from src.brownian.simulate.sampling import sigma2_range, alpha_range
 
-# Create parameter tuples
-rng = np.random.default_rng(seed)
-models_BM = enumerate(sigma2_range)
-models_OU = product(enumerate(sigma2_range), enumerate(alpha_range))
+
+def get_fits(values):
+    """Return dictionary of BM and OU fits for samples in rows of values."""
+    mu_hat_BM, sigma2_hat_BM = phylo.get_brownian_mles_batch(cov_reference, inv_reference, values)
+    loglikelihood_hat_BM = phylo.get_brownian_loglikelihood_batch(mu_hat_BM, sigma2_hat_BM,
+                                                                  cov_reference, inv_reference, values)
+
+    mu_hat_OU, sigma2_hat_OU, alpha_hat_OU = phylo.get_OU_mles_batch(cov_reference, values)
+    loglikelihood_hat_OU = phylo.get_OU_loglikelihood_batch(mu_hat_OU, sigma2_hat_OU, alpha_hat_OU,
+                                                            cov_reference, values)
+
+    return {'mu_hat_BM': mu_hat_BM, 'sigma2_hat_BM': sigma2_hat_BM,
+            'loglikelihood_hat_BM': loglikelihood_hat_BM,
+            'mu_hat_OU': mu_hat_OU, 'sigma2_hat_OU': sigma2_hat_OU, 'alpha_hat_OU': alpha_hat_OU,
+            'loglikelihood_hat_OU': loglikelihood_hat_OU}
+
+
+def get_cell_key(cell, seed_sequence):
+    """Return hash of the inputs of a cell, so results from runs with different inputs are not reused."""
+    model, sigma2_id, alpha_id = cell
+    sigma2 = float(sigma2_range[sigma2_id])
+    alpha = float(alpha_range[alpha_id]) if model == 'OU' else None
+    inputs = (model, sigma2, alpha, num_samples, seed_sequence.entropy, seed_sequence.spawn_key, str(tree_reference))
+    return hashlib.sha256(repr(inputs).encode()).hexdigest()[:16]
+
+
+def get_cell_path(cell, seed_sequence):
+    model, sigma2_id, alpha_id = cell
+    key = get_cell_key(cell, seed_sequence)
+    if model == 'BM':
+        return f'out/cells/{model}_{sigma2_id}_{key}.tsv'
+    else:
+        return f'out/cells/{model}_{sigma2_id}_{alpha_id}_{key}.tsv'
+
+
+def simulate_cell(args):
+    """Simulate and fit samples for a cell of the parameter grid and write the results to its file."""
+    cell, seed_sequence = args
+    model, sigma2_id, alpha_id = cell
+    rng = np.random.default_rng(seed_sequence)
+
+    # Samples for a cell are drawn as a single matrix by transforming standard normals with the Cholesky factor of
+    # the covariance matrix, and all samples are then fit together
+    sigma2 = sigma2_range[sigma2_id]
+    if model == 'BM':
+        cov = cov_reference * sigma2
+        ids = {'sigma2_id': sigma2_id, 'sample_id': np.arange(num_samples),
+               'sigma2': sigma2}
+    else:
+        alpha = alpha_range[alpha_id]
+        cov = phylo.get_OU_covariance_batch(alpha, cov_reference * sigma2)[0]
+        ids = {'sigma2_id': sigma2_id, 'alpha_id': alpha_id, 'sample_id': np.arange(num_samples),
+               'sigma2': sigma2, 'alpha': alpha}
+    chol = np.linalg.cholesky(cov)
+    values = rng.standard_normal((num_samples, len(tips_reference))) @ chol.transpose()
+    df = pd.DataFrame({**ids, **get_fits(values)})
+
+    # Write to temporary file and rename so interrupted runs never leave partial cells
+    path = get_cell_path(cell, seed_sequence)
+    df.to_csv(f'{path}.tmp', sep='\t', index=False)
+    os.replace(f'{path}.tmp', path)
+
+    return path
+
+
+num_processes = int(os.environ.get('SLURM_CPUS_ON_NODE', 1))
 
 # Load and calculate reference tree and its parameters
 tree_template = skbio.read('../../../data/trees/consensus_LG/100R_NI.nwk', 'newick', skbio.TreeNode)
@@ -22,61 +85,37 @@ tree_reference = tree_template.shear({tip.name for tip in tree_template.tips() i
 tips_reference, cov_reference = phylo.get_brownian_covariance(tree_reference)
 inv_reference = np.linalg.inv(cov_reference)
 
-if not os.path.exists('out/'):
-    os.mkdir('out/')
+if __name__ == '__main__':
+    # Create parameter cells
+    # Each cell is assigned its own seed spawned from the global seed, so its samples do not depend on the order in
+    # which cells are executed or on which cells were completed in previous runs
+    cells_BM = [('BM', sigma2_id, None) for sigma2_id in range(len(sigma2_range))]
+    cells_OU = [('OU', sigma2_id, alpha_id) for sigma2_id, alpha_id in product(range(len(sigma2_range)),
+                                                                             range(len(alpha_range)))]
+    cells = cells_BM + cells_OU
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(cells))
 
-# BM simulations
-rows = []
-for sigma2_id, sigma2 in models_BM:
-    for sample_id in range(num_samples):
-        tree = tree_reference.copy()
-        tips = list(tree.tips())
-        cov = cov_reference * sigma2
-        values = stats.multivariate_normal.rvs(cov=cov, random_state=rng)
-        for tip, value in zip(tips, values):
-            tip.value = value
-
-        mu_hat_BM, sigma2_hat_BM = phylo.get_brownian_mles(cov=cov_reference, inv=inv_reference, values=values)
-        loglikelihood_hat_BM = phylo.get_brownian_loglikelihood(mu_hat_BM, sigma2_hat_BM,
-                                                                cov=cov_reference, inv=inv_reference, values=values)
-
-        mu_hat_OU, sigma2_hat_OU, alpha_hat_OU = phylo.get_OU_mles(tips=tips, ts=cov_reference)
-        loglikelihood_hat_OU = phylo.get_OU_loglikelihood(mu_hat_OU, sigma2_hat_OU, alpha_hat_OU,
-                                                          tips=tips, ts=cov_reference)
-
-        rows.append({'sigma2_id': sigma2_id, 'sample_id': sample_id,
-                     'sigma2': sigma2,
-                     'mu_hat_BM': mu_hat_BM, 'sigma2_hat_BM': sigma2_hat_BM,
-                     'loglikelihood_hat_BM': loglikelihood_hat_BM,
-                     'mu_hat_OU': mu_hat_OU, 'sigma2_hat_OU': sigma2_hat_OU, 'alpha_hat_OU': alpha_hat_OU,
-                     'loglikelihood_hat_OU': loglikelihood_hat_OU})
-df_BM = pd.DataFrame(rows)
-df_BM.to_csv('out/models_BM.tsv', sep='\t', index=False)
-
-# OU simulations
-rows = []
-for (sigma2_id, sigma2), (alpha_id, alpha) in models_OU:
-    for sample_id in range(num_samples):
-        tree = tree_reference.copy()
-        tips = list(tree.tips())
-        _, cov = phylo.get_OU_covariance(alpha, tips=tips, ts=cov_reference * sigma2)
-        values = stats.multivariate_normal.rvs(cov=cov, random_state=rng)
-        for tip, value in zip(tips, values):
-            tip.value = value
-
-        mu_hat_BM, sigma2_hat_BM = phylo.get_brownian_mles(cov=cov_reference, inv=inv_reference, values=values)
-        loglikelihood_hat_BM = phylo.get_brownian_loglikelihood(mu_hat_BM, sigma2_hat_BM,
-                                                                cov=cov_reference, inv=inv_reference, values=values)
-
-        mu_hat_OU, sigma2_hat_OU, alpha_hat_OU = phylo.get_OU_mles(tips=tips, ts=cov_reference)
-        loglikelihood_hat_OU = phylo.get_OU_loglikelihood(mu_hat_OU, sigma2_hat_OU, alpha_hat_OU,
-                                                          tips=tips, ts=cov_reference)
-
-        rows.append({'sigma2_id': sigma2_id, 'alpha_id': alpha_id, 'sample_id': sample_id,
-                     'sigma2': sigma2, 'alpha': alpha,
-                     'mu_hat_BM': mu_hat_BM, 'sigma2_hat_BM': sigma2_hat_BM,
-                     'loglikelihood_hat_BM': loglikelihood_hat_BM,
-                     'mu_hat_OU': mu_hat_OU, 'sigma2_hat_OU': sigma2_hat_OU, 'alpha_hat_OU': alpha_hat_OU,
-                     'loglikelihood_hat_OU': loglikelihood_hat_OU})
-df_OU = pd.DataFrame(rows)
-df_OU.to_csv('out/models_OU.tsv', sep='\t', index=False)
+    if not os.path.exists('out/cells/'):
+        os.makedirs('out/cells/')
+
+    # Simulate cells without results from previous runs with the same inputs
+    args = [(cell, seed_sequence) for cell, seed_sequence in zip(cells, seed_sequences)
+            if not os.path.exists(get_cell_path(cell, seed_sequence))]
+    with mp.Pool(processes=num_processes) as pool:
+        pool.map(simulate_cell, args, chunksize=1)
+
+    # Merge cells
+    paths = [get_cell_path(cell, seed_sequence) for cell, seed_sequence in zip(cells, seed_sequences)]
+    df_BM = pd.concat([pd.read_table(path) for path in paths[:len(cells_BM)]], ignore_index=True)
+    df_BM.to_csv('out/models_BM.tsv', sep='\t', index=False)
+
+    df_OU = pd.concat([pd.read_table(path) for path in paths[len(cells_BM):]], ignore_index=True)
+    df_OU.to_csv('out/models_OU.tsv', sep='\t', index=False)
+
+"""
+NOTES
+Results of each cell of the parameter grid are written to out/cells/ as they complete. If the script is interrupted,
+re-running it simulates only the missing cells, and the merged tables are identical to those of an uninterrupted run.
+The name of each cell's file includes a hash of all its inputs (the model parameters, number of samples, seed, and
+reference tree), so changing any of them recalculates the cell rather than merging stale results.
+"""
@@ -5,33 +5,13 @@ import re
 from collections import Counter
 from subprocess import run
 
+import numpy as np
 import scipy.ndimage as ndimage
 import skbio
+from src.intervals import get_nested, get_overlaps
 from src.utils import read_fasta
 
 
-def has_overlap(start1, stop1, start2, stop2):
-    if stop1 < start1:
-        raise ValueError('stop1 < start1')
-    if stop2 < start2:
-        raise ValueError('stop2 < start2')
-    if start1 == stop1 or start2 == stop2:
-        return False
-    if stop2 < stop1:
-        start1, start2 = start2, start1
-        stop1, stop2 = stop2, stop1
-    return stop1 > start2
-
-
-def is_nested(character, characters):
-    """Return if character is nested in one of intervals in characters."""
-    start1, stop1 = character
-    for start2, stop2 in characters:
-        if (start2 <= start1) and (stop2 >= stop1):
-            return True
-    return False
-
-
 ppid_regex = r'ppid=([A-Za-z0-9_.]+)'
 spid_regex = r'spid=([a-z]+)'
 start_regex = r'start=([0-9]+)'
@@ -118,14 +98,12 @@ for OGid, regions in OGid2regions.items():
         for start, stop, seq in ppid2tips[ppid]:
             binary[start:stop] = [int(sym) for sym in seq]
 
-        characters = []
-        for s, in ndimage.find_objects(ndimage.label(binary)[0]):
-            characters.append((s.start, s.stop))
-            no_overlaps = []
-            for missing_start, missing_stop in ppid2missing[ppid]:
-                no_overlaps.append(not has_overlap(s.start, s.stop, missing_start, missing_stop))
-            if all(no_overlaps):
-                character_set.add((s.start, s.stop))  # Only add indels which do not overlap with missing segments
+        characters = [(s.start, s.stop) for s, in ndimage.find_objects(ndimage.label(binary)[0])]
+        characters = np.array(characters, dtype=int).reshape(-1, 2)
+        missing = np.array(ppid2missing[ppid], dtype=int).reshape(-1, 2)
+        overlaps = get_overlaps(characters[:, 0], characters[:, 1], missing[:, 0], missing[:, 1])
+        for start, stop in characters[~overlaps]:
+            character_set.add((int(start), int(stop)))  # Only add indels which do not overlap with missing segments
         ids2characters[(ppid, spid)] = characters
     character_set = sorted(character_set, key=lambda x: (x[0], -x[1]))  # Fix order of characters
 
@@ -134,14 +112,11 @@ for OGid, regions in OGid2regions.items():
         continue
 
     # Make character alignment
+    character_array = np.array(character_set, dtype=int)
     msa = []
     for (ppid, spid), characters in ids2characters.items():
-        seq = []
-        for character in character_set:
-            if is_nested(character, characters):
-                seq.append('1')
-            else:
-                seq.append('0')
+        nested = get_nested(character_array[:, 0], character_array[:, 1], characters[:, 0], characters[:, 1])
+        seq = ['1' if is_nested else '0' for is_nested in nested]
         msa.append({'ppid': ppid, 'spid': spid, 'seq': seq})
     msa = sorted(msa, key=lambda x: x['spid'])
 
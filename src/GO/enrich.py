@@ -1,6 +1,10 @@
 """Functions for calculating GO term enrichment tests."""
 
+import multiprocessing as mp
+
 import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
 import scipy.stats as stats
 
 
@@ -23,8 +27,337 @@ def hypergeom_test(k, M, n, N):
     pvalue: float
         One-tailed p-value for hypergeometric test.
     """
-    kmax = min(n, N)
-    ks = np.arange(k, kmax + 1)
-    pmfs = stats.hypergeom.pmf(k=ks, M=M, n=n, N=N)
-    pvalue = pmfs.sum()
-    return pvalue
+    return hypergeom_sf(k, M, n, N).item()
+
+
+def hypergeom_sf(ks, Ms, ns, Ns):
+    """Return the p-values for arrays of hypergeometric tests.
+
+    The p-value of each test is P(X >= k) where X is hypergeometric with
+    parameters M, n, and N. The arguments are broadcast against each other.
+
+    The log survival functions are calculated with a single vectorized call
+    to stats.hypergeom.logsf on the distinct tests, so repeated tests, e.g.
+    against the same reference in many clusters or permutations, are only
+    calculated once. Memory usage is proportional to the number of tests.
+
+    Parameters
+    ----------
+    ks: array_like of ints
+        Numbers of objects selected from the collection with the property of interest.
+    Ms: array_like of ints
+        Numbers of objects in the collection.
+    ns: array_like of ints
+        Numbers of objects in the collection with the property of interest.
+    Ns: array_like of ints
+        Numbers of objects selected from the collection.
+
+    Returns
+    -------
+    pvalues: ndarray
+        One-tailed p-values for hypergeometric tests.
+    """
+    ks, Ms, ns, Ns = np.broadcast_arrays(*[np.asarray(x, dtype=int) for x in [ks, Ms, ns, Ns]])
+    shape = ks.shape
+    ks, Ms, ns, Ns = ks.ravel(), Ms.ravel(), ns.ravel(), Ns.ravel()
+    if len(ks) == 0:
+        return np.zeros(shape)
+
+    # Calculate distinct tests
+    params, inverse = np.unique(np.stack([ks, Ms, ns, Ns], axis=1), axis=0, return_inverse=True)
+    logsfs = stats.hypergeom.logsf(params[:, 0] - 1, params[:, 1], params[:, 2], params[:, 3])
+    logsfs = np.minimum(logsfs, 0)  # Rounding can make probabilities of full tails slightly exceed 1
+    return np.exp(logsfs[inverse.ravel()]).reshape(shape)
+
+
+def get_incidence(gaf, object_labels, term_labels=('aspect', 'GOid', 'name')):
+    """Return sparse incidence matrix of objects and their annotated terms.
+
+    Parameters
+    ----------
+    gaf: DataFrame
+        Table of annotations with one row per object and term pair.
+        Duplicate pairs are counted once.
+    object_labels: list of str
+        Labels of columns identifying objects, e.g. ['OGid'] or ['OGid', 'start', 'stop', 'disorder'].
+    term_labels: list of str
+        Labels of columns identifying terms.
+
+    Returns
+    -------
+    objects: MultiIndex
+        Keys of objects in order of rows of incidence matrix
+    terms: MultiIndex
+        Keys of terms in order of columns of incidence matrix
+    incidence: csr_matrix
+        Matrix of ints where entry (i, j) is 1 if object i is annotated with term j
+    """
+    object_codes, objects = pd.MultiIndex.from_frame(gaf[list(object_labels)]).factorize()
+    term_codes, terms = pd.MultiIndex.from_frame(gaf[list(term_labels)]).factorize()
+    objects, terms = objects.set_names(list(object_labels)), terms.set_names(list(term_labels))
+    data = np.ones(len(gaf), dtype=int)
+    incidence = sparse.csr_matrix((data, (object_codes, term_codes)), shape=(len(objects), len(terms)))
+    incidence.data[:] = 1  # Duplicate pairs are summed when constructed, so reset to indicator
+    return objects, terms, incidence
+
+
+def get_selection(objects, key_sets):
+    """Return sparse matrix indicating objects selected by each set of keys.
+
+    Keys which are not in objects, i.e. objects without annotations, are
+    ignored.
+
+    Parameters
+    ----------
+    objects: MultiIndex
+        Keys of objects in order of rows of incidence matrix
+    key_sets: list of DataFrames
+        Keys of objects in each selection set with columns in the same
+        order as the levels of objects.
+
+    Returns
+    -------
+    selection: csc_matrix
+        Matrix of ints with shape (number of objects, number of sets)
+    """
+    rows, columns = [], []
+    for j, keys in enumerate(key_sets):
+        idx = objects.get_indexer(pd.MultiIndex.from_frame(keys))
+        idx = np.unique(idx[idx != -1])
+        rows.append(idx)
+        columns.append(np.full(len(idx), j))
+    rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+    columns = np.concatenate(columns) if columns else np.array([], dtype=int)
+    data = np.ones(len(rows), dtype=int)
+    return sparse.csc_matrix((data, (rows, columns)), shape=(len(objects), len(key_sets)))
+
+
+def get_label_matrix(objects, incidence, keys):
+    """Return sparse matrix of the terms annotated to each row of keys.
+
+    Rows of the incidence matrix are gathered once for all keys, so the
+    labels of a term are a column of the matrix rather than a loop over
+    keys. The matrix is in CSC format, so the indices of the rows labeled
+    with a term are a view of the matrix's data.
+
+    Parameters
+    ----------
+    objects: MultiIndex
+        Keys of objects in order of rows of incidence matrix
+    incidence: csr_matrix
+        Incidence matrix of objects and terms from get_incidence
+    keys: DataFrame
+        Keys of rows with columns in the same order as the levels of
+        objects. Keys may be repeated, and keys which are not in objects,
+        i.e. objects without annotations, have no labels.
+
+    Returns
+    -------
+    labels: csc_matrix
+        Matrix of bools with shape (number of keys, number of terms)
+    """
+    idx = objects.get_indexer(pd.MultiIndex.from_frame(keys))
+    mask = sparse.diags((idx != -1).astype(int), dtype=int)
+    labels = mask @ incidence[np.maximum(idx, 0)]  # Zero rows of missing keys
+    labels.eliminate_zeros()
+    return labels.astype(bool).tocsc()
+
+
+def get_term_counts(incidence, selection):
+    """Return counts of annotated and selected objects for all terms and selection sets.
+
+    The counts for all terms and sets are calculated with a single sparse
+    matrix product.
+
+    Parameters
+    ----------
+    incidence: csr_matrix
+        Incidence matrix of objects and terms from get_incidence
+    selection: csc_matrix
+        Selection matrix of objects and sets from get_selection
+
+    Returns
+    -------
+    ks: ndarray
+        Number of selected objects with each term with shape (number of terms, number of sets)
+    M: int
+        Number of objects
+    ns: ndarray
+        Number of objects with each term
+    Ns: ndarray
+        Number of selected objects in each set
+    """
+    ks = (incidence.transpose() @ selection).toarray()
+    M = incidence.shape[0]
+    ns = np.asarray(incidence.sum(axis=0)).ravel()
+    Ns = np.asarray(selection.sum(axis=0)).ravel()
+    return ks, M, ns, Ns
+
+
+def get_range_term_counts(labels, starts, stops, block_size=1000):
+    """Return counts of annotated rows for all terms and contiguous ranges of rows.
+
+    The rows of each range must be contiguous, e.g. the tips of the nodes of
+    a tree in postorder. The counts of all ranges are then differences of the
+    cumulative sums of the labels over rows, so the cost is nearly
+    independent of the number and sizes of the ranges. The cumulative sums
+    are calculated in blocks of terms to limit memory usage.
+
+    Parameters
+    ----------
+    labels: sparse matrix
+        Matrix of rows and terms, e.g. from get_label_matrix
+    starts: ndarray
+        Index of first row of each range. Only the ranges which are tested
+        should be given since the counts are returned as a dense array.
+    stops: ndarray
+        Index after last row of each range
+    block_size: int
+        Number of terms whose cumulative sums are calculated at once
+
+    Returns
+    -------
+    ks: ndarray
+        Number of rows in each range with each term with shape (number of terms, number of ranges)
+    Ns: ndarray
+        Number of rows in each range with any term
+    """
+    labels = sparse.csc_matrix(labels)
+    starts, stops = np.asarray(starts), np.asarray(stops)
+    num_terms = labels.shape[1]
+
+    ks = np.empty((num_terms, len(starts)), dtype=np.int32)
+    for j in range(0, num_terms, block_size):
+        block = labels[:, j:j+block_size].toarray().astype(np.int32)
+        cumsums = np.concatenate([np.zeros((1, block.shape[1]), dtype=np.int32), np.cumsum(block, axis=0)])
+        ks[j:j+block_size] = (cumsums[stops] - cumsums[starts]).transpose()
+
+    cumsums = np.concatenate([[0], np.cumsum(labels.getnnz(axis=1) > 0)])
+    Ns = cumsums[stops] - cumsums[starts]
+    return ks, Ns
+
+
+def _init_permutation_worker(incidence, codes, strata, counts):
+    """Set arrays for permutation tests as globals in worker processes."""
+    global _permutation_args
+    _permutation_args = incidence, codes, strata, counts
+
+
+def _count_permutations(args):
+    """Return number of random selections where the count of each term is at least its observed count."""
+    seed_sequence, num_permutations, ks = args
+    incidence, codes, strata, counts = _permutation_args
+    rng = np.random.default_rng(seed_sequence)
+    selection = get_random_selection(rng, codes, strata, counts, num_permutations)
+    ks_permutation = (incidence.transpose() @ selection).toarray()
+    return (ks_permutation >= np.expand_dims(ks, 1)).sum(axis=1)
+
+
+def get_random_selection(rng, codes, strata, counts, num_permutations):
+    """Return sparse matrix of random selections of objects stratified by group.
+
+    Each random selection has the same number of selected objects in each
+    group as the observed selection, but the counts are assigned to random
+    groups in the same stratum, and the objects within each group are
+    chosen at random.
+
+    Parameters
+    ----------
+    rng: Generator
+    codes: ndarray
+        Group of each object as ints from 0 to the number of groups - 1
+    strata: ndarray
+        Stratum of each group as ints from 0 to the number of strata - 1
+    counts: ndarray
+        Number of selected objects in each group
+    num_permutations: int
+
+    Returns
+    -------
+    selection: csc_matrix
+        Matrix of ints with shape (number of objects, num_permutations)
+    """
+    num_objects, num_groups = len(codes), len(counts)
+
+    # Permute counts between groups in the same stratum
+    # Sorting the stratum plus a uniform random number puts the groups of each stratum in a random order within the
+    # stratum's block, so counts listed in stratum order are assigned to random groups of the same stratum
+    group_order = np.argsort(strata, kind='stable')
+    random_order = np.argsort(strata + rng.random((num_permutations, num_groups)), axis=1)
+    permuted_counts = np.empty((num_permutations, num_groups), dtype=int)
+    np.put_along_axis(permuted_counts, random_order, counts[group_order], axis=1)
+
+    # Select objects with the smallest random ranks in each group
+    object_order = np.argsort(codes + rng.random((num_permutations, num_objects)), axis=1)
+    sorted_codes = np.sort(codes)
+    group_starts = np.searchsorted(sorted_codes, np.arange(num_groups))
+    ranks = np.arange(num_objects) - group_starts[sorted_codes]
+    mask = ranks < permuted_counts[:, sorted_codes]
+    rows = object_order[mask]
+    columns = np.nonzero(mask)[0]
+    data = np.ones(len(rows), dtype=int)
+    return sparse.csc_matrix((data, (rows, columns)), shape=(num_objects, num_permutations))
+
+
+def permutation_test(incidence, objects, keys, group_label='OGid', num_permutations=1000, seed=None,
+                     num_processes=1, batch_size=100):
+    """Return empirical p-values of term counts in a selection against random selections stratified by group.
+
+    Objects in the same group, e.g. regions of the same OGid, often share
+    their annotations, so they are not independent draws as assumed by the
+    hypergeometric test. The null distribution is instead generated by
+    random selections which preserve the number of selected objects in each
+    group. The counts are assigned to random groups with the same number of
+    objects, and the objects within each group are chosen at random.
+
+    The random selections are generated in batches, and the term counts of a
+    batch are calculated with a single sparse matrix product. Batches are
+    distributed over a pool of processes with seeds spawned from seed.
+
+    Parameters
+    ----------
+    incidence: csr_matrix
+        Incidence matrix of objects and terms from get_incidence
+    objects: MultiIndex
+        Keys of objects in order of rows of incidence matrix
+    keys: DataFrame
+        Keys of selected objects with columns in the same order as the
+        levels of objects.
+    group_label: str
+        Level of objects defining groups
+    num_permutations: int
+    seed: int
+    num_processes: int
+    batch_size: int
+        Number of random selections per task
+
+    Returns
+    -------
+    ks: ndarray
+        Number of selected objects with each term
+    pvalues: ndarray
+        Empirical p-values calculated as (1 + number of random selections
+        with counts at least k) / (1 + num_permutations)
+    """
+    selection = get_selection(objects, [keys])
+    ks = (incidence.transpose() @ selection).toarray()[:, 0]
+
+    codes, _ = pd.factorize(objects.get_level_values(group_label))
+    sizes = np.bincount(codes)
+    counts = np.bincount(codes[selection.indices], minlength=len(sizes))
+    _, strata = np.unique(sizes, return_inverse=True)
+
+    batch_sizes = [min(batch_size, num_permutations - start) for start in range(0, num_permutations, batch_size)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    args = [(seed_sequence, size, ks) for seed_sequence, size in zip(seed_sequences, batch_sizes)]
+    initargs = (incidence, codes, strata.ravel(), counts)
+    if num_processes > 1:
+        with mp.Pool(processes=num_processes, initializer=_init_permutation_worker, initargs=initargs) as pool:
+            exceeds = pool.map(_count_permutations, args)
+    else:
+        _init_permutation_worker(*initargs)
+        exceeds = [_count_permutations(arg) for arg in args]
+    exceeds = np.sum(exceeds, axis=0) if exceeds else np.zeros(len(ks), dtype=int)
+
+    pvalues = (1 + exceeds) / (1 + num_permutations)
+    return ks, pvalues
@@ -0,0 +1,257 @@
+"""Functions and class for loading the GO ontology and its ancestor closure."""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+
+def get_file_hash(path):
+    """Return SHA-256 hex digest of file at path."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(2 ** 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _encode_strings(strings):
+    """Return strings as concatenated UTF-8 bytes and offsets."""
+    encoded = [string.encode() for string in strings]
+    offsets = np.concatenate([[0], np.cumsum([len(x) for x in encoded])]).astype(np.int64)
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_strings(data, offsets):
+    """Return object array of strings from concatenated UTF-8 bytes and offsets."""
+    buffer = data.tobytes()
+    strings = [buffer[start:stop].decode() for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    return np.array(strings, dtype=object)
+
+
+class Ontology:
+    """Terms and is_a relationships of an ontology as arrays indexed by term.
+
+    Parameters
+    ----------
+    ids: ndarray
+        Ids of terms
+    names: ndarray
+        Names of terms
+    primary_idxs: ndarray
+        Index of primary term of each term, which is itself for primary terms
+    is_obsolete: ndarray
+        Boolean array indicating if term is obsolete
+    parents: csr_matrix
+        Boolean matrix where entry (i, j) is True if term j is a parent of term i
+    closure: csr_matrix
+        Boolean matrix where entry (i, j) is True if term j is an ancestor of
+        term i. Calculated from parents if not given.
+    """
+    def __init__(self, ids, names, primary_idxs, is_obsolete, parents, closure=None):
+        self.ids = ids
+        self.names = names
+        self.primary_idxs = primary_idxs
+        self.is_obsolete = is_obsolete
+        self.parents = parents
+        self._closure = closure
+        self._index = pd.Index(ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def closure(self):
+        if self._closure is None:
+            self._closure = get_closure(self.parents)
+        return self._closure
+
+    @closure.setter
+    def closure(self, closure):
+        self._closure = closure
+
+    def get_idxs(self, ids):
+        """Return indices of ids, raising KeyError if any are not in ontology."""
+        idxs = self._index.get_indexer(ids)
+        if np.any(idxs == -1):
+            raise KeyError(f'{np.asarray(ids)[idxs == -1][0]} is not in ontology.')
+        return idxs
+
+    def save(self, path, file_hash=''):
+        """Save ontology as binary snapshot at path."""
+        id_data, id_offsets = _encode_strings(self.ids)
+        name_data, name_offsets = _encode_strings(self.names)
+        closure = self.closure
+        with open(f'{path}.tmp', 'wb') as file:
+            np.savez(file, file_hash=np.array(file_hash),
+                     id_data=id_data, id_offsets=id_offsets, name_data=name_data, name_offsets=name_offsets,
+                     primary_idxs=self.primary_idxs, is_obsolete=self.is_obsolete,
+                     parent_indptr=self.parents.indptr, parent_indices=self.parents.indices,
+                     closure_indptr=closure.indptr, closure_indices=closure.indices)
+        os.replace(f'{path}.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """Return ontology and hash of its OBO file from binary snapshot at path."""
+        with np.load(path) as snapshot:
+            ids = _decode_strings(snapshot['id_data'], snapshot['id_offsets'])
+            names = _decode_strings(snapshot['name_data'], snapshot['name_offsets'])
+            n = len(ids)
+            matrices = []
+            for prefix in ['parent', 'closure']:
+                indptr, indices = snapshot[f'{prefix}_indptr'], snapshot[f'{prefix}_indices']
+                data = np.ones(len(indices), dtype=bool)
+                matrices.append(sparse.csr_matrix((data, indices, indptr), shape=(n, n)))
+            parents, closure = matrices
+            ontology = cls(ids, names, snapshot['primary_idxs'], snapshot['is_obsolete'], parents, closure)
+            file_hash = snapshot['file_hash'].item()
+        return ontology, file_hash
+
+
+def parse_obo(path):
+    """Return ontology of terms and is_a relationships in an OBO file.
+
+    The file is streamed once, and the fields of each [Term] stanza are
+    appended directly to flat lists which are converted to arrays at the end.
+    Alternate ids are included as terms after the primary terms. They have
+    the name and obsolete flag of their primary term but no parents.
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    ontology: Ontology
+    """
+    ids, names, is_obsolete = [], [], []
+    alt_ids, alt_primary_idxs = [], []
+    child_idxs, parent_ids = [], []
+    in_term = False
+    with open(path) as file:
+        for line in file:
+            if line.startswith('['):
+                in_term = line.startswith('[Term]')
+                if in_term:
+                    ids.append(None)
+                    names.append(None)
+                    is_obsolete.append(False)
+                continue
+            if not in_term:
+                continue
+
+            tag, _, value = line.rstrip('\n').partition(': ')
+            if tag == 'id':
+                ids[-1] = value
+            elif tag == 'name':
+                names[-1] = value
+            elif tag == 'alt_id':
+                alt_ids.append(value)
+                alt_primary_idxs.append(len(ids) - 1)
+            elif tag == 'is_a':
+                child_idxs.append(len(ids) - 1)
+                parent_ids.append(value.split('!')[0].strip())
+            elif tag == 'is_obsolete':
+                is_obsolete[-1] = value == 'true'
+
+    # Append alternate ids as terms
+    alt_primary_idxs = np.array(alt_primary_idxs, dtype=int)
+    primary_idxs = np.concatenate([np.arange(len(ids)), alt_primary_idxs])
+    names = np.array(names + alt_ids, dtype=object)  # Alternate names are replaced below
+    names[len(ids):] = names[alt_primary_idxs]
+    ids = np.array(ids + alt_ids, dtype=object)
+    is_obsolete = np.array(is_obsolete, dtype=bool)[primary_idxs]
+
+    # Convert is_a relationships to matrix
+    parent_idxs = pd.Index(ids).get_indexer(parent_ids)
+    if np.any(parent_idxs == -1):
+        raise RuntimeError('Ontology contains is_a relationships to undefined terms.')
+    data = np.ones(len(child_idxs), dtype=bool)
+    parents = sparse.csr_matrix((data, (child_idxs, parent_idxs)), shape=(len(ids), len(ids)))
+
+    return Ontology(ids, names, primary_idxs, is_obsolete, parents)
+
+
+def get_closure(parents):
+    """Return ancestor closure of a DAG given by its parent matrix.
+
+    Terms are visited once in topological order, i.e. parents before their
+    children, so the ancestors of a term are the union of its parents'
+    ancestors, which are already complete.
+
+    Parameters
+    ----------
+    parents: csr_matrix
+        Boolean matrix where entry (i, j) is True if term j is a parent of term i
+
+    Returns
+    -------
+    closure: csr_matrix
+        Boolean matrix where entry (i, j) is True if term j is an ancestor of
+        term i. Terms are included as their own ancestors.
+    """
+    parents = sparse.csr_matrix(parents)
+    n = parents.shape[0]
+    indptr, indices = parents.indptr, parents.indices
+
+    # Kahn's algorithm on edges from parents to children
+    children = parents.transpose().tocsr()
+    num_parents = np.diff(indptr)
+    stack = list(np.nonzero(num_parents == 0)[0])
+    order = []
+    while stack:
+        idx = stack.pop()
+        order.append(idx)
+        for child in children.indices[children.indptr[idx]:children.indptr[idx+1]]:
+            num_parents[child] -= 1
+            if num_parents[child] == 0:
+                stack.append(child)
+    if len(order) != n:
+        raise RuntimeError('Ontology contains a cycle.')
+
+    ancestors = [None] * n
+    for idx in order:
+        ancestor_set = {idx}
+        for parent in indices[indptr[idx]:indptr[idx+1]]:
+            ancestor_set |= ancestors[parent]
+        ancestors[idx] = ancestor_set
+
+    lengths = np.array([len(ancestor_set) for ancestor_set in ancestors])
+    closure_indptr = np.concatenate([[0], np.cumsum(lengths)])
+    closure_indices = np.fromiter((ancestor for ancestor_set in ancestors for ancestor in sorted(ancestor_set)),
+                                  dtype=np.int64, count=closure_indptr[-1])
+    data = np.ones(len(closure_indices), dtype=bool)
+    return sparse.csr_matrix((data, closure_indices, closure_indptr), shape=(n, n))
+
+
+def load_ontology(path, snapshot_path):
+    """Return ontology of OBO file, using a binary snapshot keyed on the file's hash.
+
+    Parameters
+    ----------
+    path: str
+        Path to OBO file
+    snapshot_path: str
+        Path to snapshot file, e.g. in the out/ directory of the calling
+        script. The snapshot is recalculated if it is missing or was
+        calculated from a file with a different hash.
+
+    Returns
+    -------
+    ontology: Ontology
+        Ontology with its closure calculated
+    """
+    file_hash = get_file_hash(path)
+
+    if os.path.exists(snapshot_path):
+        ontology, snapshot_hash = Ontology.load(snapshot_path)
+        if snapshot_hash == file_hash:
+            return ontology
+
+    ontology = parse_obo(path)
+    ontology.closure = get_closure(ontology.parents)
+    ontology.save(snapshot_path, file_hash)
+
+    return ontology
@@ -1,5 +1,6 @@
 """Functions for manipulating linkage matrices returned by the SciPy linkage module."""
 
+import numpy as np
 import skbio
 
 
@@ -32,3 +33,40 @@ def make_tree(lm):
         heights[node_id] = distance
     tree = nodes[2*(num_tips-1)]
     return tree
+
+
+def get_tip_ranges(tree):
+    """Return tips in postorder and the contiguous range of tips descending from each node.
+
+    In a postorder traversal, the tips descending from a node are visited
+    consecutively, so the tips of each node are the half-open range
+    tips[start:stop].
+
+    Parameters
+    ----------
+    tree: TreeNode
+
+    Returns
+    -------
+    tips: list of TreeNodes
+        Tips in postorder
+    nodes: list of TreeNodes
+        All nodes, including tips, in postorder
+    starts: ndarray
+        Index of first tip of each node
+    stops: ndarray
+        Index after last tip of each node
+    """
+    tips, nodes, starts, stops = [], [], [], []
+    id2start = {}
+    for node in tree.postorder(include_self=True):
+        if node.is_tip():
+            start = len(tips)
+            tips.append(node)
+        else:
+            start = id2start[id(node.children[0])]
+        id2start[id(node)] = start
+        nodes.append(node)
+        starts.append(start)
+        stops.append(len(tips))
+    return tips, nodes, np.array(starts), np.array(stops)
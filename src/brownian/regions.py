@@ -0,0 +1,58 @@
+"""Functions for arranging features of regions for parallel computation."""
+
+import numpy as np
+import pandas as pd
+
+
+def get_region_layout(grouped, feature_labels):
+    """Return features of regions as blocks of rows in a matrix and tasks indexing the blocks.
+
+    Each region is a contiguous block of rows sorted by spid, and regions
+    with the same set of species share a subset id. Tasks are then
+    described by integers only, so the features and trees do not need to be
+    pickled for each task.
+
+    Parameters
+    ----------
+    grouped: iterable of (name, DataFrame)
+        Iterable of region names and their features, e.g. a DataFrameGroupBy.
+        Each DataFrame must have a spid column and feature_labels columns.
+    feature_labels: list of str
+
+    Returns
+    -------
+    names: list
+        Names of regions in order of region ids
+    values: ndarray
+        Feature values with shape (number of rows, number of features)
+    subsets: list of tuples
+        Sorted spids of each subset in order of subset ids
+    tasks: list of tuples
+        Tuples of (region_id, row_start, row_stop, subset_id)
+    """
+    names, groups, tasks = [], [], []
+    subset2id = {}
+    row_start = 0
+    for region_id, (name, group) in enumerate(grouped):
+        group = group.sort_values('spid')
+        row_stop = row_start + len(group)
+        subset_id = subset2id.setdefault(tuple(group['spid']), len(subset2id))
+
+        names.append(name)
+        groups.append(group[feature_labels])
+        tasks.append((region_id, row_start, row_stop, subset_id))
+        row_start = row_stop
+
+    if groups:
+        values = pd.concat(groups).to_numpy(dtype=float)
+    else:
+        values = np.empty((0, len(feature_labels)))
+    subsets = list(subset2id)
+
+    return names, values, subsets, tasks
+
+
+def get_tip_order(tips, spids):
+    """Return indices which reorder rows sorted as spids into the order of tips."""
+    spid2idx = {spid: idx for idx, spid in enumerate(spids)}
+    return np.array([spid2idx[tip.name] for tip in tips])
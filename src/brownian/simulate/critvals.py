@@ -0,0 +1,76 @@
+"""Functions for critical values of OU vs BM likelihood ratios on specific trees."""
+
+import hashlib
+
+import numpy as np
+import src.phylo as phylo
+
+
+def get_subset_key(spids):
+    """Return string key identifying a set of species."""
+    return ','.join(sorted(spids))
+
+
+def get_subset_seed(seed, key):
+    """Return SeedSequence for a species subset derived from a global seed and the subset key.
+
+    The seed depends only on the global seed and the subset, so the critical
+    values of a subset are reproducible regardless of which other subsets are
+    computed or the order they are computed in.
+    """
+    digest = hashlib.sha256(key.encode()).digest()
+    return np.random.SeedSequence([seed, int.from_bytes(digest[:8], 'little')])
+
+
+def get_delta_loglikelihoods(cov, num_samples, rng):
+    """Return OU - BM log-likelihoods for samples simulated under BM.
+
+    The likelihood ratio is invariant to the scale of the data, so samples
+    are simulated with mu = 0 and sigma2 = 1 without loss of generality.
+
+    Parameters
+    ----------
+    cov: ndarray
+        Brownian motion covariance matrix of tree
+    num_samples: int
+    rng: Generator
+
+    Returns
+    -------
+    delta_loglikelihoods: ndarray
+    """
+    inv = np.linalg.inv(cov)
+    chol = np.linalg.cholesky(cov)
+    values = rng.standard_normal((num_samples, len(cov))) @ chol.transpose()
+
+    mus_BM, sigma2s_BM = phylo.get_brownian_mles_batch(cov, inv, values)
+    loglikelihoods_BM = phylo.get_brownian_loglikelihood_batch(mus_BM, sigma2s_BM, cov, inv, values)
+
+    mus_OU, sigma2s_OU, alphas_OU = phylo.get_OU_mles_batch(cov, values)
+    loglikelihoods_OU = phylo.get_OU_loglikelihood_batch(mus_OU, sigma2s_OU, alphas_OU, cov, values)
+
+    return loglikelihoods_OU - loglikelihoods_BM
+
+
+def get_critvals(tree, num_samples, rng, quantiles=(0.95, 0.99), chunksize=1000):
+    """Return quantiles of OU - BM log-likelihoods simulated under BM on tree.
+
+    Parameters
+    ----------
+    tree: TreeNode (skbio)
+    num_samples: int
+    rng: Generator
+    quantiles: tuple of floats
+    chunksize: int
+        Maximum number of samples fit at once to limit memory usage
+
+    Returns
+    -------
+    critvals: ndarray
+        Critical values in order of quantiles
+    """
+    _, cov = phylo.get_brownian_covariance(tree)
+    deltas = []
+    for start in range(0, num_samples, chunksize):
+        deltas.append(get_delta_loglikelihoods(cov, min(chunksize, num_samples - start), rng))
+    return np.quantile(np.concatenate(deltas), quantiles)
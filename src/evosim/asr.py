@@ -1,9 +1,67 @@
 """Common functions for simulating sequence evolution."""
 
-from copy import deepcopy
+import multiprocessing as mp
+from copy import copy, deepcopy
+from time import perf_counter
 
 import numpy as np
-import scipy.stats as stats
+from src.evosim.fenwick import FenwickTree
+
+
+def get_alias_table(p):
+    """Return Walker alias table for sampling from discrete distribution p.
+
+    Parameters
+    ----------
+    p: ndarray
+        One-dimensional array of probabilities which sum to 1.
+
+    Returns
+    -------
+    probs: ndarray
+        Probability of accepting the drawn index over its alias.
+    aliases: ndarray
+        Alias of each index.
+    """
+    n = len(p)
+    probs = np.asarray(p, dtype=float) * n
+    aliases = np.arange(n)
+    small = [i for i in range(n) if probs[i] < 1]
+    large = [i for i in range(n) if probs[i] >= 1]
+    while small and large:
+        i, j = small.pop(), large.pop()
+        aliases[i] = j
+        probs[j] = probs[j] + probs[i] - 1
+        if probs[j] < 1:
+            small.append(j)
+        else:
+            large.append(j)
+    for i in small + large:  # Remaining entries are 1 up to rounding errors
+        probs[i] = 1
+    return probs, aliases
+
+
+def sample_alias(probs, aliases, rng, size=None):
+    """Return random indices drawn from alias table in O(1) time per draw.
+
+    Parameters
+    ----------
+    probs: ndarray
+    aliases: ndarray
+    rng: numpy Generator instance
+    size: int
+        If None, a single index is returned.
+
+    Returns
+    -------
+    idx: int or ndarray
+    """
+    x = rng.random(size) * len(probs)
+    if size is None:
+        i = int(x)
+        return i if x - i < probs[i] else aliases[i]
+    i = x.astype(int)
+    return np.where(x - i < probs[i], i, aliases[i])
 
 
 class SeqEvolver:
@@ -15,6 +73,19 @@ class SeqEvolver:
     number of residues deleted is equal to the given length or no more residues
     remain.
 
+    Residues are stored in the order they were created in arrays with extra
+    capacity, which doubles when full, so insertions append to the arrays
+    rather than copying them. The order of residues in the sequence is given
+    by a linked list of storage indices. The arrays in sequence order are
+    available as the attributes seq, rate_coefficients, activities,
+    residue_ids, partition_ids, and rates.
+
+    Events are sampled from a Fenwick tree over the active rates, so
+    selecting an event and updating the rates after an event take O(log L)
+    time per residue. The rate of event i at storage index j is stored at
+    index 3*j + i of the tree. The methods for individual events accept
+    storage indices.
+
     An "immortal link" (Thorne et al., 1991) can be included at the beginning
     to allow indels before the first symbol. The immortal link is never
     inactive to ensure a sequence can always generate new symbols. Immortal
@@ -58,104 +129,262 @@ class SeqEvolver:
     """
     def __init__(self, seq, rate_coefficients, activities, residue_ids, partition_ids,
                  rate_matrices, sym_dists, insertion_dists, deletion_dists, rng=None):
-        self.seq = seq
-        self.rate_coefficients = rate_coefficients
-        self.activities = activities
-        self.residue_ids = residue_ids
-        self.partition_ids = partition_ids
         self.rate_matrices = rate_matrices
         self.sym_dists = sym_dists
         self.insertion_dists = insertion_dists
         self.deletion_dists = deletion_dists
         self.rng = rng
 
-        # Calculate rates from rate matrices and rate coefficients
-        rates = np.empty(len(seq))
-        for j, (idx, partition_id) in enumerate(zip(self.seq, self.partition_ids)):
-            rate = 0 if idx == -1 else -self.rate_matrices[partition_id][idx, idx]  # Check for "out-of-alphabet" symbols
-            rates[j] = rate
-        self.rates = rates * self.rate_coefficients
-
-        # Calculate jump matrices from rate matrices
-        jump_matrices = {}
+        # Calculate jump matrices and diagonal rates from rate matrices
+        jump_matrices, diagonal_rates = {}, {}
         for partition_id, rate_matrix in rate_matrices.items():
             jump_matrix = np.copy(rate_matrix)
             np.fill_diagonal(jump_matrix, 0)
             jump_matrix = jump_matrix / np.expand_dims(jump_matrix.sum(axis=1), -1)  # Normalize rows to obtain jump matrix
             jump_matrices[partition_id] = jump_matrix
+            diagonal_rates[partition_id] = -np.diag(rate_matrix)
         self.jump_matrices = jump_matrices
+        self.diagonal_rates = diagonal_rates
+
+        # Calculate alias tables for jump matrix rows and symbol distributions
+        jump_tables = {}
+        for partition_id, jump_matrix in jump_matrices.items():
+            tables = [get_alias_table(jump_dist) for jump_dist in jump_matrix]
+            jump_tables[partition_id] = (np.stack([probs for probs, _ in tables]),
+                                         np.stack([aliases for _, aliases in tables]))
+        self.jump_tables = jump_tables
+        self.sym_tables = {partition_id: get_alias_table(sym_dist) for partition_id, sym_dist in sym_dists.items()}
+
+        # Calculate rates from rate matrices and rate coefficients
+        rates = np.empty(len(seq))
+        for j, (idx, partition_id) in enumerate(zip(seq, partition_ids)):
+            rate = 0 if idx == -1 else self.diagonal_rates[partition_id][idx]  # Check for "out-of-alphabet" symbols
+            rates[j] = rate
+        rates = rates * rate_coefficients
+
+        # Store arrays with initial order as storage order
+        self._size = len(seq)
+        self._seq = np.array(seq)
+        self._rate_coefficients = np.array(rate_coefficients, dtype=float)
+        self._activities = np.array(activities, dtype=bool)
+        self._residue_ids = np.array(residue_ids)
+        self._partition_ids = np.array(partition_ids)
+        self._rates = rates
+        self._next_idxs = np.append(np.arange(1, self._size), -1)  # -1 marks end of sequence
+        self._head_idx = 0 if self._size > 0 else -1
+        self._order = None
+
+        self.rate_tree = FenwickTree((self._rates * self._activities).transpose().flatten())
+        self._resize(2 * self._size)
 
     def __deepcopy__(self, memodict={}):
-        seq = np.copy(self.seq)
-        rate_coefficients = np.copy(self.rate_coefficients)
-        activities = np.copy(self.activities)
-        residue_ids = np.copy(self.residue_ids)
-        partition_ids = np.copy(self.partition_ids)
-        return SeqEvolver(seq, rate_coefficients, activities, residue_ids, partition_ids,
-                          self.rate_matrices, self.sym_dists, self.insertion_dists, self.deletion_dists, self.rng)
-
-    def mutate(self, residue_index):
-        """Mutate the sequence."""
-        event_ids = np.arange(3*len(self.seq))
-        active_rates = (self.rates * self.activities).flatten()
-        p = active_rates / active_rates.sum()
-        event_id = self.rng.choice(event_ids, p=p)
-        i, j = event_id // len(self.seq), event_id % len(self.seq)
-        if i == 0:
-            return self.substitute(j, residue_index)
-        elif i == 1:
-            return self.insert(j, residue_index)
-        elif i == 2:
-            return self.delete(j, residue_index)
+        evoseq = copy(self)  # Shallow copy shares models and rng
+        evoseq._seq = np.copy(self._seq)
+        evoseq._rate_coefficients = np.copy(self._rate_coefficients)
+        evoseq._activities = np.copy(self._activities)
+        evoseq._residue_ids = np.copy(self._residue_ids)
+        evoseq._partition_ids = np.copy(self._partition_ids)
+        evoseq._rates = np.copy(self._rates)
+        evoseq._next_idxs = np.copy(self._next_idxs)
+        evoseq.rate_tree = deepcopy(self.rate_tree)
+        return evoseq
+
+    def __len__(self):
+        return self._size
+
+    def _resize(self, capacity):
+        """Resize storage arrays to capacity."""
+        def resize(array):
+            resized = np.zeros(array.shape[:-1] + (capacity,), dtype=array.dtype)
+            resized[..., :self._size] = array[..., :self._size]
+            return resized
+
+        self._seq = resize(self._seq)
+        self._rate_coefficients = resize(self._rate_coefficients)
+        self._activities = resize(self._activities)
+        self._residue_ids = resize(self._residue_ids)
+        self._partition_ids = resize(self._partition_ids)
+        self._rates = resize(self._rates)
+        self._next_idxs = resize(self._next_idxs)
+        self.rate_tree.resize(3 * capacity)
+
+    @property
+    def order(self):
+        """Return storage indices of residues in sequence order."""
+        if self._order is None:
+            order = np.empty(self._size, dtype=int)
+            idx = self._head_idx
+            for n in range(self._size):
+                order[n] = idx
+                idx = self._next_idxs[idx]
+            self._order = order
+        return self._order
+
+    @property
+    def seq(self):
+        return self._seq[self.order]
+
+    @property
+    def rate_coefficients(self):
+        return self._rate_coefficients[:, self.order]
+
+    @property
+    def activities(self):
+        return self._activities[self.order]
+
+    @property
+    def residue_ids(self):
+        return self._residue_ids[self.order]
+
+    @property
+    def partition_ids(self):
+        return self._partition_ids[self.order]
+
+    @property
+    def rates(self):
+        return self._rates[:, self.order]
+
+    def total_rate(self):
+        """Return total rate of all active events."""
+        return self.rate_tree.total()
+
+    def mutate(self, residue_index, profile=None):
+        """Mutate the sequence.
+
+        If profile is given, the event type and the time spent applying the
+        event are recorded in it.
+        """
+        if self.rate_tree.total() <= 0:
+            raise ValueError('Sequence has no active events.')
+        event_id = self.rate_tree.search(self.rng.random() * self.rate_tree.total())
+        if self.rate_tree.values[event_id] == 0:  # Rounding errors can select an inactive event
+            nonzero_idxs = np.flatnonzero(self.rate_tree.values)
+            if len(nonzero_idxs) == 0:
+                raise ValueError('Sequence has no active events.')
+            idx = np.searchsorted(nonzero_idxs, event_id)
+            event_id = nonzero_idxs[idx] if idx < len(nonzero_idxs) else nonzero_idxs[-1]
+        j, i = divmod(event_id, 3)
+        event = [self.substitute, self.insert, self.delete][i]
+        if profile is None:
+            return event(j, residue_index)
+
+        t0 = perf_counter()
+        residue_index = event(j, residue_index)
+        profile.add_event(SimulationProfile.event_types[i], perf_counter() - t0)
+        return residue_index
 
     def substitute(self, j, residue_index):
-        """Substitute residue at index j."""
-        partition_id = self.partition_ids[j]
-        jump_dist = self.jump_matrices[partition_id][self.seq[j]]
-        idx = self.rng.choice(np.arange(len(jump_dist)), p=jump_dist)
-        rate = -self.rate_matrices[partition_id][idx, idx]
+        """Substitute residue at storage index j."""
+        partition_id = self._partition_ids[j]
+        probs, aliases = self.jump_tables[partition_id]
+        idx = sample_alias(probs[self._seq[j]], aliases[self._seq[j]], self.rng)
+        rate = self.diagonal_rates[partition_id][idx]
 
-        self.seq[j] = idx
-        self.rates[:, j] = rate * self.rate_coefficients[:, j]
+        self._seq[j] = idx
+        self._rates[:, j] = rate * self._rate_coefficients[:, j]
+        for i in range(3):
+            self.rate_tree.update(3*j+i, self._rates[i, j] * self._activities[j])
 
         return residue_index
 
     def insert(self, j, residue_index):
-        """Insert randomly generated residues at an index j."""
-        partition_id = self.partition_ids[j]
-        sym_dist = self.sym_dists[partition_id]
+        """Insert randomly generated residues after storage index j."""
+        partition_id = self._partition_ids[j]
         length = self.insertion_dists[partition_id].rvs(random_state=self.rng)
+        if length == 0:
+            return residue_index
+
+        # Append insertion to storage arrays
+        start, stop = self._size, self._size + length
+        if stop > self._seq.shape[-1]:
+            self._resize(max(2 * self._seq.shape[-1], stop))
 
-        # Make insertion arrays
-        # (rate_coefficients and rates are transposed since it makes the insertion syntax simpler)
-        seq = self.rng.choice(np.arange(len(sym_dist)), size=length, p=sym_dist)
-        rate_coefficients = np.full((length, 3), self.rate_coefficients[:, j])
-        activities = np.full(length, True)
-        residue_ids = np.arange(residue_index, residue_index+length)
-        partition_ids = np.full(length, partition_id)
-        rates = np.expand_dims([-self.rate_matrices[partition_id][idx, idx] for idx in seq], -1)
-
-        # Insert insertion into arrays
-        self.seq = np.insert(self.seq, j+1, seq)
-        self.rate_coefficients = np.insert(self.rate_coefficients, j+1, rate_coefficients, axis=1)  # Insert matches first axis of inserted array to one given by axis keyword
-        self.activities = np.insert(self.activities, j+1, activities)
-        self.residue_ids = np.insert(self.residue_ids, j+1, residue_ids)
-        self.partition_ids = np.insert(self.partition_ids, j+1, partition_ids)
-        self.rates = np.insert(self.rates, j+1, rates * rate_coefficients, axis=1)
+        seq = sample_alias(*self.sym_tables[partition_id], self.rng, size=length)
+        rates = self.diagonal_rates[partition_id][seq]
+        self._seq[start:stop] = seq
+        self._rate_coefficients[:, start:stop] = self._rate_coefficients[:, [j]]
+        self._activities[start:stop] = True
+        self._residue_ids[start:stop] = np.arange(residue_index, residue_index+length)
+        self._partition_ids[start:stop] = partition_id
+        self._rates[:, start:stop] = rates * self._rate_coefficients[:, start:stop]
+        for event_id in range(3*start, 3*stop):
+            k, i = divmod(event_id, 3)
+            self.rate_tree.update(event_id, self._rates[i, k])
+
+        # Link insertion into sequence after j
+        self._next_idxs[start:stop-1] = np.arange(start+1, stop)
+        self._next_idxs[stop-1] = self._next_idxs[j]
+        self._next_idxs[j] = start
+        self._size = stop
+        self._order = None
 
         return residue_index + length
 
     def delete(self, j, residue_index):
-        """Delete residues at an index j."""
-        partition_id = self.partition_ids[j]
+        """Delete residues beginning at storage index j."""
+        partition_id = self._partition_ids[j]
         length = self.deletion_dists[partition_id].rvs(random_state=self.rng)
 
-        self.activities[j:j+length] = False
+        idx = j
+        for _ in range(length):
+            if idx == -1:
+                break
+            self._activities[idx] = False
+            for i in range(3):
+                self.rate_tree.update(3*idx+i, 0)
+            idx = self._next_idxs[idx]
 
         return residue_index
 
 
-def simulate_tree(tree, evoseq, rng):
+class SimulationProfile:
+    """A record of the events in a simulation.
+
+    Attributes
+    ----------
+    branch_counts: list of tuples of (name, length, count)
+        Number of events on each branch in order of traversal.
+    event_counts: dict of ints
+        Number of events of each type.
+    event_times: dict of floats
+        Time in seconds spent applying events of each type.
+    """
+    event_types = ['substitution', 'insertion', 'deletion']
+
+    def __init__(self):
+        self.branch_counts = []
+        self.event_counts = {event_type: 0 for event_type in self.event_types}
+        self.event_times = {event_type: 0.0 for event_type in self.event_types}
+
+    def add_branch(self, name, length, count):
+        self.branch_counts.append((name, length, count))
+
+    def add_event(self, event_type, time):
+        self.event_counts[event_type] += 1
+        self.event_times[event_type] += time
+
+
+def simulate_tree(tree, evoseq, rng, profile=None):
+    """Simulate sequence evolution along a tree.
+
+    Parameters
+    ----------
+    tree: TreeNode (skbio)
+    evoseq: SeqEvolver
+        Sequence at root.
+    rng: numpy Generator instance
+        Generator for waiting times and child orders.
+    profile: SimulationProfile
+        If given, events per branch and time spent in each event type are
+        recorded in it.
+
+    Returns
+    -------
+    residue_index: int
+        Next unused residue id.
+    evoseqs: list of tuples of (name, SeqEvolver)
+        Sequences at tips.
+    """
     tree = tree.copy()  # Make copy so computations do not change original tree
     tree.evoseq, tree.t = evoseq, 0
     residue_index = max(evoseq.residue_ids) + 1
@@ -163,10 +392,17 @@ def simulate_tree(tree, evoseq, rng):
     evoseqs = []
     for node in tree.traverse():
         evoseq, t = node.evoseq, node.t
+        count = 0
         while t < node.length:
-            residue_index = evoseq.mutate(residue_index)
-            scale = 1/(evoseq.rates * evoseq.activities).sum()
-            t += stats.expon.rvs(scale=scale, random_state=rng)
+            if evoseq.total_rate() <= 0:  # Stop branch if no events can occur, e.g. all residues were deleted
+                t = node.length
+                break
+            residue_index = evoseq.mutate(residue_index, profile)
+            count += 1
+            if evoseq.total_rate() > 0:
+                t += rng.exponential(1/evoseq.total_rate())
+        if profile is not None:
+            profile.add_branch(node.name, node.length, count)
         if node.children:
             if rng.random() > 0.5:
                 child1, child2 = node.children
@@ -179,3 +415,239 @@ def simulate_tree(tree, evoseq, rng):
             evoseqs.append((node.name, evoseq))
 
     return residue_index, evoseqs
+
+
+class AlignmentStore:
+    """A columnar store of simulated sequences from replicate simulations.
+
+    Each row of the store is a tip from one replicate. The symbols, residue
+    ids, and activities of all rows are concatenated into single arrays, and
+    the residues of row k are in the slice offsets[k]:offsets[k+1].
+
+    Parameters
+    ----------
+    path: str
+        If given, store is loaded from an npz file written by save.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            self.replicate_ids = np.empty(0, dtype=int)
+            self.names = np.empty(0, dtype=str)
+            self.offsets = np.zeros(1, dtype=int)
+            self.seq = np.empty(0, dtype=int)
+            self.residue_ids = np.empty(0, dtype=int)
+            self.activities = np.empty(0, dtype=bool)
+        else:
+            with np.load(path) as data:
+                self.replicate_ids = data['replicate_ids']
+                self.names = data['names']
+                self.offsets = data['offsets']
+                self.seq = data['seq']
+                self.residue_ids = data['residue_ids']
+                self.activities = data['activities']
+        self._chunks = []
+
+    def __len__(self):
+        self._flush()
+        return len(self.replicate_ids)
+
+    def _flush(self):
+        """Concatenate appended chunks into arrays."""
+        if not self._chunks:
+            return
+        replicate_ids = [self.replicate_ids]
+        names = [self.names]
+        lengths = [np.diff(self.offsets)]
+        seqs, residue_ids, activities = [self.seq], [self.residue_ids], [self.activities]
+        for chunk in self._chunks:
+            replicate_ids.append(np.full(len(chunk['names']), chunk['replicate_id']))
+            names.append(np.array(chunk['names'], dtype=str))
+            lengths.append(chunk['lengths'])
+            seqs.append(chunk['seq'])
+            residue_ids.append(chunk['residue_ids'])
+            activities.append(chunk['activities'])
+        self.replicate_ids = np.concatenate(replicate_ids)
+        self.names = np.concatenate(names)
+        self.offsets = np.concatenate([[0], np.cumsum(np.concatenate(lengths))])
+        self.seq = np.concatenate(seqs)
+        self.residue_ids = np.concatenate(residue_ids)
+        self.activities = np.concatenate(activities)
+        self._chunks = []
+
+    def append(self, replicate_id, names, lengths, seq, residue_ids, activities):
+        """Append the tips of a replicate to the store.
+
+        Parameters
+        ----------
+        replicate_id: int
+        names: list of str
+            Names of tips in order of rows.
+        lengths: ndarray
+            Number of residues in each tip.
+        seq, residue_ids, activities: ndarray
+            Concatenated arrays of tips in order of rows.
+        """
+        self._chunks.append({'replicate_id': replicate_id, 'names': names, 'lengths': lengths,
+                             'seq': seq, 'residue_ids': residue_ids, 'activities': activities})
+
+    def get_replicate(self, replicate_id):
+        """Return list of (name, seq, residue_ids, activities) for tips of a replicate."""
+        self._flush()
+        records = []
+        for k in np.flatnonzero(self.replicate_ids == replicate_id):
+            s = slice(self.offsets[k], self.offsets[k+1])
+            records.append((str(self.names[k]), self.seq[s], self.residue_ids[s], self.activities[s]))
+        return records
+
+    def save(self, path):
+        """Save store to npz file at path."""
+        self._flush()
+        np.savez_compressed(path, replicate_ids=self.replicate_ids, names=self.names, offsets=self.offsets,
+                            seq=self.seq, residue_ids=self.residue_ids, activities=self.activities)
+
+
+def _init_replicate_worker(tree, evoseq):
+    global _replicate_tree, _replicate_evoseq
+    _replicate_tree, _replicate_evoseq = tree, evoseq
+
+
+def _simulate_replicate(args):
+    replicate_id, seed_seq = args
+    rng = np.random.default_rng(seed_seq)
+    evoseq = deepcopy(_replicate_evoseq)
+    evoseq.rng = rng
+    _, evoseqs = simulate_tree(_replicate_tree, evoseq, rng)
+
+    names = [name for name, _ in evoseqs]
+    lengths = np.array([len(evoseq) for _, evoseq in evoseqs])
+    seq = np.concatenate([evoseq.seq for _, evoseq in evoseqs])
+    residue_ids = np.concatenate([evoseq.residue_ids for _, evoseq in evoseqs])
+    activities = np.concatenate([evoseq.activities for _, evoseq in evoseqs])
+    return replicate_id, names, lengths, seq, residue_ids, activities
+
+
+def simulate_replicates(tree, evoseq, num_replicates, seed, num_processes=1, store=None, chunksize=1):
+    """Simulate independent replicates of sequence evolution along a tree.
+
+    Each replicate uses its own generator spawned from a SeedSequence of the
+    seed, so results are reproducible regardless of the number of
+    processes.
+
+    Parameters
+    ----------
+    tree: TreeNode (skbio)
+    evoseq: SeqEvolver
+        Initial sequence at root. It is copied for each replicate, and its
+        generator is replaced by the replicate's generator.
+    num_replicates: int
+    seed: int or SeedSequence
+    num_processes: int
+        Number of processes in pool. If 1, replicates are simulated in the
+        current process.
+    store: AlignmentStore
+        If given, replicates are appended to this store.
+    chunksize: int
+        Number of replicates sent to a worker process at a time.
+
+    Returns
+    -------
+    store: AlignmentStore
+    """
+    if store is None:
+        store = AlignmentStore()
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    args = enumerate(seed_seq.spawn(num_replicates))
+
+    if num_processes == 1:
+        _init_replicate_worker(tree, evoseq)
+        for record in map(_simulate_replicate, args):
+            store.append(*record)
+    else:
+        with mp.Pool(processes=num_processes, initializer=_init_replicate_worker, initargs=(tree, evoseq)) as pool:
+            for record in pool.imap(_simulate_replicate, args, chunksize=chunksize):
+                store.append(*record)
+
+    return store
+
+
+def get_alignment(records):
+    """Return the true alignment of simulated sequences from their residue ids.
+
+    Every residue created in a simulation has a unique id, and inactive
+    residues are retained, so each sequence's residue ids are a subsequence
+    of a common order. The order is found by merging the sequences one at a
+    time. Residues not yet in the merged order are placed after the last
+    shared residue that precedes them, which only requires sorting and binary
+    searches. Columns with no active residues are removed.
+
+    Parameters
+    ----------
+    records: list of tuples of (name, SeqEvolver) or (name, seq, residue_ids, activities)
+        Simulated sequences as returned by simulate_tree or
+        AlignmentStore.get_replicate.
+
+    Returns
+    -------
+    names: list of str
+    column_ids: ndarray
+        Residue id of each column.
+    msa: ndarray
+        Array with shape (len(names), len(column_ids)) where entries are
+        symbol indices or -1 for gaps.
+    """
+    if records and isinstance(records[0][1], SeqEvolver):
+        records = [(name, evoseq.seq, evoseq.residue_ids, evoseq.activities) for name, evoseq in records]
+
+    def get_positions(column_ids, residue_ids):
+        """Return positions of residue_ids in column_ids or -1 if absent."""
+        if len(column_ids) == 0:
+            return np.full(len(residue_ids), -1)
+        sorter = np.argsort(column_ids)
+        idx = np.searchsorted(column_ids, residue_ids, sorter=sorter)
+        idx = np.minimum(idx, len(column_ids) - 1)
+        positions = sorter[idx]
+        return np.where(column_ids[positions] == residue_ids, positions, -1)
+
+    # Merge residue ids into common order
+    column_ids = np.empty(0, dtype=int)
+    for _, _, residue_ids, _ in records:
+        positions = get_positions(column_ids, residue_ids)
+        is_new = positions == -1
+        anchors = np.maximum.accumulate(positions)  # Position of last shared residue at or before each residue
+        new_ids = residue_ids[is_new]
+        keys1 = np.concatenate([np.arange(len(column_ids)), anchors[is_new]])
+        keys2 = np.concatenate([np.zeros(len(column_ids), dtype=int), np.ones(len(new_ids), dtype=int)])
+        keys3 = np.concatenate([np.zeros(len(column_ids), dtype=int), np.flatnonzero(is_new)])
+        order = np.lexsort([keys3, keys2, keys1])
+        column_ids = np.concatenate([column_ids, new_ids])[order]
+
+    # Fill alignment
+    names = []
+    msa = np.full((len(records), len(column_ids)), -1)
+    for i, (name, seq, residue_ids, activities) in enumerate(records):
+        names.append(name)
+        positions = get_positions(column_ids, residue_ids)
+        msa[i, positions[activities]] = seq[activities]
+    is_nongap = (msa != -1).any(axis=0)
+
+    return names, column_ids[is_nongap], msa[:, is_nongap]
+
+
+def write_alignment(path, records, alphabet):
+    """Write true alignment of simulated sequences to FASTA file at path.
+
+    Parameters
+    ----------
+    path: str
+    records: list of tuples
+        Simulated sequences in any format accepted by get_alignment.
+    alphabet: str or list of str
+        Symbols in order of indices in sequences.
+    """
+    names, _, msa = get_alignment(records)
+    syms = np.array(list(alphabet) + ['-'])  # Gaps (-1) index the last entry
+    with open(path, 'w') as file:
+        for name, row in zip(names, msa):
+            seq = ''.join(syms[row])
+            seqstring = '\n'.join([seq[i:i+80] for i in range(0, len(seq), 80)])
+            file.write(f'>{name}\n{seqstring}\n')
@@ -0,0 +1,96 @@
+"""Fenwick tree for sampling events proportionally to their rates."""
+
+import numpy as np
+
+
+class FenwickTree:
+    """A binary indexed tree of non-negative values.
+
+    The tree supports updating a value and finding the index at which the
+    cumulative sum of values exceeds a given value in O(log n) time. Drawing a
+    uniform random number in [0, total) and searching for it then samples an
+    index with probability proportional to its value. The total of all
+    values is maintained separately, so it is available in O(1) time. The
+    total is re-summed when it becomes small relative to its largest value,
+    so rounding errors cannot make it negative when all values return to
+    zero.
+
+    Parameters
+    ----------
+    values: ndarray
+        One-dimensional array of non-negative values.
+    """
+    tol = 1E-9  # Total is re-summed when it falls below this fraction of its largest value
+
+    def __init__(self, values):
+        self.values = np.array(values, dtype=float)
+        self.tree = self._build(self.values)
+        self._total = self.values.sum()
+        self._scale = self._total  # Largest total since last re-sum
+
+    def __len__(self):
+        return len(self.values)
+
+    @staticmethod
+    def _build(values):
+        """Return tree array for values in O(n) time.
+
+        The tree is 1-indexed, so node i stores the sum of the lowbit(i) values
+        ending at index i-1 of values. These sums are calculated as
+        differences of a cumulative sum.
+        """
+        idx = np.arange(len(values) + 1)
+        lowbits = idx & -idx
+        sums = np.concatenate([[0], np.cumsum(values)])
+        tree = sums - sums[idx - lowbits]
+        return tree
+
+    def resize(self, n):
+        """Resize tree to n values, padding with zeros or truncating as needed."""
+        values = np.zeros(n)
+        m = min(n, len(self.values))
+        values[:m] = self.values[:m]
+        self.values = values
+        self.tree = self._build(self.values)
+        self._total = self.values.sum()  # Re-sum to remove accumulated rounding errors
+        self._scale = self._total
+
+    def total(self):
+        """Return sum of all values."""
+        return self._total
+
+    def prefix_sum(self, n):
+        """Return sum of first n values."""
+        s = 0
+        while n > 0:
+            s += self.tree[n]
+            n -= n & -n
+        return s
+
+    def update(self, idx, value):
+        """Set the value at index idx."""
+        delta = value - self.values[idx]
+        self.values[idx] = value
+        self._total += delta
+        if self._total <= self.tol * self._scale:
+            # Rounding errors accumulated at the scale of the largest total can dominate a small total or make it
+            # negative, so it is re-summed
+            self._total = self.values.sum()
+            self._scale = self._total
+        self._scale = max(self._scale, self._total)
+        n = idx + 1
+        while n < len(self.tree):
+            self.tree[n] += delta
+            n += n & -n
+
+    def search(self, value):
+        """Return the smallest index where the cumulative sum of values exceeds value."""
+        idx = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step > 0:
+            n = idx + step
+            if n < len(self.tree) and self.tree[n] <= value:
+                idx = n
+                value -= self.tree[n]
+            step >>= 1
+        return min(idx, len(self.values) - 1)  # Clip in case of rounding errors at the end of the tree
@@ -0,0 +1,142 @@
+"""Functions for queries between sets of half-open intervals using sorted arrays and binary search."""
+
+import numpy as np
+
+
+def _check_intervals(starts, stops):
+    """Return starts and stops as integer arrays after checking they are valid intervals."""
+    starts, stops = np.asarray(starts, dtype=int), np.asarray(stops, dtype=int)
+    if starts.shape != stops.shape:
+        raise ValueError('starts and stops have different shapes')
+    if np.any(stops < starts):
+        raise ValueError('stops < starts')
+    return starts, stops
+
+
+def get_overlaps(starts1, stops1, starts2, stops2):
+    """Return if intervals in the first set overlap any interval in the second set.
+
+    Empty intervals do not overlap any interval.
+
+    Parameters
+    ----------
+    starts1, stops1: array_like
+        Starts and stops of first set of intervals.
+    starts2, stops2: array_like
+        Starts and stops of second set of intervals.
+
+    Returns
+    -------
+    overlaps: ndarray
+        Boolean array with the length of the first set of intervals.
+    """
+    starts1, stops1 = _check_intervals(starts1, stops1)
+    starts2, stops2 = _check_intervals(starts2, stops2)
+    idx = starts2 < stops2  # Remove empty intervals
+    starts2, stops2 = starts2[idx], stops2[idx]
+    if len(starts2) == 0:
+        return np.zeros(len(starts1), dtype=bool)
+
+    # An interval overlaps the second set if the maximum stop of the intervals starting before its stop exceeds its start
+    order = np.argsort(starts2, kind='stable')
+    starts2, max_stops2 = starts2[order], np.maximum.accumulate(stops2[order])
+    counts = np.searchsorted(starts2, stops1, side='left')  # Number of intervals starting before stop1
+    max_stops = np.where(counts > 0, max_stops2[np.maximum(counts - 1, 0)], np.iinfo(int).min)
+    return (max_stops > starts1) & (starts1 < stops1)
+
+
+def get_nested(starts1, stops1, starts2, stops2):
+    """Return if intervals in the first set are nested in any interval in the second set.
+
+    An interval is nested in another if its start is greater than or equal to
+    the other's start and its stop is less than or equal to the other's stop.
+
+    Parameters
+    ----------
+    starts1, stops1: array_like
+        Starts and stops of first set of intervals.
+    starts2, stops2: array_like
+        Starts and stops of second set of intervals.
+
+    Returns
+    -------
+    nested: ndarray
+        Boolean array with the length of the first set of intervals.
+    """
+    starts1, stops1 = _check_intervals(starts1, stops1)
+    starts2, stops2 = _check_intervals(starts2, stops2)
+    if len(starts2) == 0:
+        return np.zeros(len(starts1), dtype=bool)
+
+    # An interval is nested if the maximum stop of the intervals starting at or before its start reaches its stop
+    order = np.argsort(starts2, kind='stable')
+    starts2, max_stops2 = starts2[order], np.maximum.accumulate(stops2[order])
+    counts = np.searchsorted(starts2, starts1, side='right')  # Number of intervals starting at or before start1
+    max_stops = np.where(counts > 0, max_stops2[np.maximum(counts - 1, 0)], np.iinfo(int).min)
+    return max_stops >= stops1
+
+
+def get_merged(starts, stops):
+    """Return the disjoint intervals covering the union of the input intervals.
+
+    Empty intervals are removed, and intervals which overlap or abut are
+    merged.
+
+    Parameters
+    ----------
+    starts, stops: array_like
+        Starts and stops of intervals.
+
+    Returns
+    -------
+    merged_starts, merged_stops: ndarray
+        Starts and stops of merged intervals in sorted order.
+    """
+    starts, stops = _check_intervals(starts, stops)
+    idx = starts < stops
+    starts, stops = starts[idx], stops[idx]
+    if len(starts) == 0:
+        return starts, stops
+
+    order = np.argsort(starts, kind='stable')
+    starts, max_stops = starts[order], np.maximum.accumulate(stops[order])
+    is_first = np.concatenate([[True], starts[1:] > max_stops[:-1]])  # Interval starts a new merged interval
+    is_last = np.concatenate([is_first[1:], [True]])
+    return starts[is_first], max_stops[is_last]
+
+
+def get_overlap_lengths(starts1, stops1, starts2, stops2):
+    """Return number of positions of intervals in the first set covered by the second set.
+
+    Positions covered by multiple intervals in the second set are counted
+    once, i.e. the second set is treated as a mask.
+
+    Parameters
+    ----------
+    starts1, stops1: array_like
+        Starts and stops of first set of intervals.
+    starts2, stops2: array_like
+        Starts and stops of second set of intervals.
+
+    Returns
+    -------
+    lengths: ndarray
+        Integer array with the length of the first set of intervals.
+    """
+    starts1, stops1 = _check_intervals(starts1, stops1)
+    starts2, stops2 = get_merged(starts2, stops2)
+    if len(starts2) == 0:
+        return np.zeros(len(starts1), dtype=int)
+
+    # Number of covered positions before each merged interval
+    lengths2 = stops2 - starts2
+    offsets = np.concatenate([[0], np.cumsum(lengths2)])
+
+    def get_coverage(xs):
+        """Return number of covered positions in [0, x) for each x."""
+        idx = np.searchsorted(starts2, xs, side='right') - 1  # Last merged interval starting at or before x
+        clipped_idx = np.maximum(idx, 0)
+        partial = np.clip(xs - starts2[clipped_idx], 0, lengths2[clipped_idx])
+        return np.where(idx >= 0, offsets[clipped_idx] + partial, 0)
+
+    return get_coverage(stops1) - get_coverage(starts1)
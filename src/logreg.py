@@ -0,0 +1,97 @@
+"""Functions for fitting many logistic regression models on a shared design matrix."""
+
+import numpy as np
+from scipy.special import expit
+
+
+def add_intercept(X):
+    """Return design matrix with a leading column of ones."""
+    X = np.asarray(X, dtype=float)
+    return np.concatenate([np.ones((len(X), 1)), X], axis=1)
+
+
+def fit_logreg_batch(X, Y, weights=None, max_iter=100, tol=1E-8):
+    """Return maximum likelihood coefficients of unpenalized logistic regressions of each target on X.
+
+    All targets share the design matrix, so the models are fit together with
+    Newton's method (iteratively reweighted least squares). Each iteration
+    calculates the gradients and Hessians of every model with a few matrix
+    products and solves the small systems as a stack. Models are removed from
+    the iteration once their largest coefficient update is less than tol.
+
+    Parameters
+    ----------
+    X: ndarray
+        Design matrix with shape (number of samples, number of parameters).
+        Include a column of ones to fit an intercept.
+    Y: ndarray
+        Boolean targets with shape (number of samples, number of models)
+    weights: ndarray
+        Sample weights with the shape of Y. Defaults to ones.
+    max_iter: int
+    tol: float
+
+    Returns
+    -------
+    betas: ndarray
+        Coefficients with shape (number of models, number of parameters)
+    converged: ndarray
+        Boolean array indicating if each model converged within max_iter
+    """
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    weights = np.ones_like(Y) if weights is None else np.asarray(weights, dtype=float)
+    num_models, num_params = Y.shape[1], X.shape[1]
+
+    betas = np.zeros((num_models, num_params))
+    converged = np.zeros(num_models, dtype=bool)
+    active = np.arange(num_models)
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        etas = X @ betas[active].transpose()
+        mus = expit(etas)
+        gradients = (weights[:, active] * (Y[:, active] - mus)).transpose() @ X
+        hessians = np.einsum('ni,nk,nj->kij', X, weights[:, active] * mus * (1 - mus), X)
+        steps = np.einsum('kij,kj->ki', np.linalg.pinv(hessians), gradients)  # pinv is robust to separable targets
+        betas[active] += steps
+
+        done = np.abs(steps).max(axis=1) < tol
+        converged[active[done]] = True
+        active = active[~done]
+
+    return betas, converged
+
+
+def predict_logreg_batch(X, betas):
+    """Return boolean predictions with shape (number of samples, number of models) of logistic regressions."""
+    return X @ betas.transpose() > 0
+
+
+def get_confusion_metrics(Y_true, Y_pred):
+    """Return accuracy, sensitivity, specificity, and precision of each column of predictions.
+
+    Parameters
+    ----------
+    Y_true: ndarray
+        Boolean array with shape (number of samples, number of models)
+    Y_pred: ndarray
+        Boolean array with shape of Y_true
+
+    Returns
+    -------
+    metrics: dict of ndarrays
+        Arrays of metrics with length of number of models keyed by name
+    """
+    Y_true, Y_pred = np.asarray(Y_true, dtype=bool), np.asarray(Y_pred, dtype=bool)
+    tp = (Y_true & Y_pred).sum(axis=0)
+    tn = (~Y_true & ~Y_pred).sum(axis=0)
+    num_positive = Y_true.sum(axis=0)
+    num_negative = len(Y_true) - num_positive
+    num_predicted = Y_pred.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {'accuracy': (tp + tn) / len(Y_true),
+                'sensitivity': tp / num_positive,
+                'specificity': tn / num_negative,
+                'precision': tp / num_predicted}
@@ -164,6 +164,68 @@ def get_brownian_loglikelihood(mu, sigma2, tree=None, cov=None, inv=None, values
     return loglikelihood
 
 
+def get_brownian_mles_batch(cov, inv, values):
+    """Get MLEs under Brownian motion model for multiple samples of tip values.
+
+    Parameters
+    ----------
+    cov: ndarray
+        Pre-computed covariance matrix
+    inv: ndarray
+        Pre-computed inverse of covariance matrix
+    values: ndarray
+        Array with shape (number of samples, number of tips) where tip values
+        are in order of entries in covariance matrix
+
+    Returns
+    -------
+    mus: ndarray
+        Inferred root values
+    sigma2s: ndarray
+        Inferred rates of trait evolution
+    """
+    row_sum = inv.sum(axis=1)
+    total_sum = inv.sum()
+    weights = row_sum / total_sum
+    N = len(cov)
+
+    mus = values @ weights
+    xs = values - np.expand_dims(mus, -1)
+    sigma2s = np.einsum('si,ij,sj->s', xs, inv, xs) / N
+
+    return mus, sigma2s
+
+
+def get_brownian_loglikelihood_batch(mus, sigma2s, cov, inv, values):
+    """Get log-likelihoods of Brownian motion model for multiple samples of tip values.
+
+    Parameters
+    ----------
+    mus: ndarray
+        Root values
+    sigma2s: ndarray
+        Rates of trait evolution
+    cov: ndarray
+        Pre-computed covariance matrix
+    inv: ndarray
+        Pre-computed inverse of covariance matrix
+    values: ndarray
+        Array with shape (number of samples, number of tips) where tip values
+        are in order of entries in covariance matrix
+
+    Returns
+    -------
+    loglikelihoods: ndarray
+    """
+    _, logdet = np.linalg.slogdet(cov)
+    N = len(cov)
+
+    xs = values - np.expand_dims(mus, -1)
+    loglikelihoods = -0.5 * (np.einsum('si,ij,sj->s', xs, inv, xs) / sigma2s + N * np.log(2 * np.pi * sigma2s) + logdet)
+
+    return loglikelihoods
+
+
 # Ornstein-Uhlenbeck
 def get_OU_covariance(alpha, tree=None, tips=None, ts=None):
     """Get covariance matrix corresponding to Ornstein-Uhlenbeck process on tree.
@@ -199,13 +261,7 @@ def get_OU_covariance(alpha, tree=None, tips=None, ts=None):
     """
     if tips is None or ts is None:
         tips, ts = get_brownian_covariance(tree)
-    cov = np.zeros((len(tips), len(tips)))
-    for i in range(len(tips)):
-        for j in range(i+1):
-            dij = ts[i, i] + ts[j, j] - 2*ts[i, j]
-            x = np.exp(-alpha * dij) / (2*alpha)
-            cov[i, j] = x
-            cov[j, i] = x
+    cov = get_OU_covariance_batch(alpha, ts)[0]
     return tips, cov
 
 
@@ -304,6 +360,130 @@ def get_OU_loglikelihood(mu, sigma2, alpha, tree=None, tips=None, ts=None):
     return loglikelihood
 
 
+def get_OU_covariance_batch(alphas, ts):
+    """Get covariance matrices of Ornstein-Uhlenbeck process for multiple values of alpha.
+
+    Parameters
+    ----------
+    alphas: ndarray
+        Strengths of selection
+    ts: ndarray
+        Pre-computed matrix of lengths of shared paths between tips
+
+    Returns
+    -------
+    covs: ndarray
+        Array with shape (len(alphas), number of tips, number of tips)
+    """
+    diag = np.diag(ts)
+    ds = np.expand_dims(diag, 0) + np.expand_dims(diag, 1) - 2 * ts
+    alphas = np.reshape(alphas, (-1, 1, 1))
+    covs = np.exp(-alphas * ds) / (2 * alphas)
+    return covs
+
+
+def get_OU_mles_batch(ts, values, alpha_min=1E-4, alpha_max=1E4, num_alphas=161):
+    """Get MLEs under Ornstein-Uhlenbeck model for multiple samples of tip values.
+
+    The profile likelihood of alpha is evaluated on a grid that is evenly
+    spaced in log space. Since the covariance matrix depends only on alpha,
+    each matrix on the grid is factorized once and shared by all samples. The
+    estimate of alpha is then refined for each sample by fitting a parabola
+    in log space to the grid point with the highest likelihood and its
+    neighbors. Estimates are restricted to the interval [alpha_min,
+    alpha_max].
+
+    Parameters
+    ----------
+    ts: ndarray
+        Pre-computed matrix of lengths of shared paths between tips
+    values: ndarray
+        Array with shape (number of samples, number of tips) where tip values
+        are in order of entries in distance matrix
+    alpha_min: float
+    alpha_max: float
+    num_alphas: int
+        Number of points in grid of alpha values
+
+    Returns
+    -------
+    mus: ndarray
+        Root and optimal values
+    sigma2s: ndarray
+        Rates of trait evolution
+    alphas: ndarray
+        Strengths of selection
+    """
+    N = len(ts)
+    log_alphas = np.linspace(np.log(alpha_min), np.log(alpha_max), num_alphas)
+    covs = get_OU_covariance_batch(np.exp(log_alphas), ts)
+    invs = np.linalg.inv(covs)
+    _, logdets = np.linalg.slogdet(covs)
+
+    # Profile negative log-likelihood for each sample and grid point
+    # The quadratic form at the MLE of mu is v'Av - (v'A1)^2 / 1'A1
+    row_sums = invs.sum(axis=2)
+    total_sums = row_sums.sum(axis=1)
+    vAvs = np.einsum('si,kij,sj->sk', values, invs, values)
+    vA1s = values @ row_sums.transpose()
+    sigma2s = (vAvs - vA1s ** 2 / total_sums) / N
+    fs = 0.5 * (N + N * np.log(2 * np.pi * sigma2s) + logdets)
+
+    # Refine with parabolic interpolation around grid minimum
+    idx = np.clip(np.argmin(fs, axis=1), 1, num_alphas - 2)
+    sample_idx = np.arange(len(values))
+    f0, f1, f2 = fs[sample_idx, idx-1], fs[sample_idx, idx], fs[sample_idx, idx+1]
+    h = log_alphas[1] - log_alphas[0]
+    denominator = f0 - 2 * f1 + f2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offsets = np.where(denominator > 0, 0.5 * h * (f0 - f2) / denominator, 0)
+    offsets = np.clip(offsets, -h, h)
+    log_alphas_hat = np.clip(log_alphas[idx] + offsets, log_alphas[0], log_alphas[-1])
+    alphas = np.exp(log_alphas_hat)
+
+    # Calculate MLEs of mu and sigma2 at estimated alphas
+    invs = np.linalg.inv(get_OU_covariance_batch(alphas, ts))
+    row_sums = invs.sum(axis=2)
+    weights = row_sums / np.expand_dims(row_sums.sum(axis=1), -1)
+    mus = np.einsum('si,si->s', weights, values)
+    xs = values - np.expand_dims(mus, -1)
+    sigma2s = np.einsum('si,sij,sj->s', xs, invs, xs) / N
+
+    return mus, sigma2s, alphas
+
+
+def get_OU_loglikelihood_batch(mus, sigma2s, alphas, ts, values):
+    """Get log-likelihoods of Ornstein-Uhlenbeck model for multiple samples of tip values.
+
+    Parameters
+    ----------
+    mus: ndarray
+        Root and optimal values
+    sigma2s: ndarray
+        Rates of trait evolution
+    alphas: ndarray
+        Strengths of selection
+    ts: ndarray
+        Pre-computed matrix of lengths of shared paths between tips
+    values: ndarray
+        Array with shape (number of samples, number of tips) where tip values
+        are in order of entries in distance matrix
+
+    Returns
+    -------
+    loglikelihoods: ndarray
+    """
+    covs = get_OU_covariance_batch(alphas, ts)
+    invs = np.linalg.inv(covs)
+    _, logdets = np.linalg.slogdet(covs)
+    N = len(ts)
+
+    xs = values - np.expand_dims(mus, -1)
+    loglikelihoods = -0.5 * (np.einsum('si,sij,sj->s', xs, invs, xs) / sigma2s + N * np.log(2 * np.pi * sigma2s) + logdets)
+
+    return loglikelihoods
+
+
 # Other utilities
 def get_conditional(tree, matrix, inplace=False):
     """Return conditional probabilities of tree given tips and node state."""
@@ -0,0 +1,85 @@
+"""Class for sharing arrays between processes without copying."""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArray:
+    """A float ndarray and its column labels in a named block of shared memory.
+
+    An array is published by the parent process with SharedArray.publish,
+    which copies it into a new block of shared memory. The parent passes the
+    (small and picklable) spec to workers, e.g. as the initargs of a pool,
+    and the workers create views of the same memory with SharedArray.attach.
+    The views are writable, so workers can also fill rows of an output array.
+
+    The publishing instance owns the block. Using it as a context manager
+    closes and unlinks the block when the context exits, including on
+    errors, so blocks are not leaked if a stage fails. Attached instances
+    only close their views.
+
+    Parameters
+    ----------
+    shm: SharedMemory
+    shape: tuple of ints
+    labels: list
+        Labels of columns of array
+    owner: bool
+        If True, unlink the block on cleanup
+    """
+    dtype = np.dtype(float)
+
+    def __init__(self, shm, shape, labels=None, owner=False):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.labels = labels
+        self.owner = owner
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    @classmethod
+    def publish(cls, array, labels=None):
+        """Return SharedArray with a copy of array in a new block of shared memory."""
+        array = np.asarray(array, dtype=cls.dtype)
+        if labels is not None and array.ndim > 1 and len(labels) != array.shape[-1]:
+            raise ValueError('Number of labels does not match number of columns in array.')
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))  # Size must be positive
+        shared = cls(shm, array.shape, labels=labels, owner=True)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def empty(cls, shape, labels=None, fill_value=np.nan):
+        """Return SharedArray of shape in a new block of shared memory filled with fill_value."""
+        shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        size = int(np.prod(shape)) * cls.dtype.itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        shared = cls(shm, shape, labels=labels, owner=True)
+        shared.array.fill(fill_value)
+        return shared
+
+    @classmethod
+    def attach(cls, spec):
+        """Return SharedArray viewing the block of shared memory described by spec."""
+        name, shape, labels = spec
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, shape, labels=labels, owner=False)
+
+    @property
+    def spec(self):
+        """Return tuple of (name, shape, labels) used to attach to block in other processes."""
+        return self.shm.name, self.shape, self.labels
+
+    def close(self):
+        """Release view of block and unlink it if this instance owns it."""
+        self.array = None  # Remove reference to buffer so it can be closed
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()